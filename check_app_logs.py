@@ -1,55 +1,190 @@
 import argparse
+import collections
+import concurrent.futures
 import datetime
 import logging
 
 import common_utils
 import environment
+import log_fingerprints
+import log_templates
+import log_timestamps
 import logs
+import pattern_matcher
 
 verbose_level = 0
+REPORT_TEMPLATE_COUNT = 50
+REPORT_TRACE_COUNT = 50
 
 
-def contains_pattern(app_name, msg_lines, pattern):
-    patterns = [pattern] if pattern else environment.APP_LOG_PATTERNS.get(app_name)
-
-    for pattern in patterns:
-        for line in msg_lines:
-            if pattern in line:
-                logging.debug("found pattern {0} in line {1}".format(pattern, line))
-                return True
-    logging.debug("did NOT find pattern {0} in line {1}".format(pattern, msg_lines))
-    return False
-
-
-def check_app_logs(app_name, log_paths, start_timestamp, end_timestamp, pattern):
-    for path in log_paths:
-        if not path.exists():
-            logging.info("The expected log file {0} does not exist.".format(path))
-            continue
-        logging.info("\nChecking file {0}".format(path))
-        file_size = path.stat().st_size
-        found_lines = []
-        with open(path, "r") as log_h:
-            current_line = None
-            timestamp, rest_of_line, current_line = logs.get_log_msg(log_h, current_line)
-            while current_line and timestamp and rest_of_line and timestamp <= end_timestamp:
-                if start_timestamp <= timestamp and timestamp <= end_timestamp and
-                    contains_pattern(app_name, rest_of_line, pattern):
-                    found_lines.append((timestamp, rest_of_line))
-
-            timestamp, rest_of_line, current_line = logs.get_log_msg(log_h, current_line)
-            # logging.info("\rpath: {} read {:2.0f}% timestamp: {}  rest_of_line empty: {}".format(path, (log_h.tell()/file_size*100), timestamp, not rest_of_line))
-
-    if found_lines:
-        logging.info("\nFound {0} log messages in file {1}\n".format(len(found_lines), path))
-        for (timestamp, rest_of_line) in found_lines:
-            logging.info("{0:%Y-%m-%d %H:%M:%s}  {1}".format(timestamp, rest_of_line[0]))
-            for idx in range(1, len(rest_of_line) - 1):
-                logging.info("{0}  {1}".format(" " * 24, rest_of_line[idx]))
+_pattern_matchers = {}
+
+
+def get_pattern_matcher(app_name, pattern, is_regex=None):
+    '''
+        Returns the compiled PatternMatcher for the pattern, or for the patterns configured for the application in
+        environment.APP_LOG_PATTERNS if no pattern is given.
+    '''
+    key = (app_name, pattern, is_regex)
+    if key not in _pattern_matchers:
+        if pattern:
+            patterns = [{"regex": pattern} if is_regex else pattern]
+        else:
+            patterns = environment.APP_LOG_PATTERNS.get(app_name, [])
+        _pattern_matchers[key] = pattern_matcher.PatternMatcher(patterns)
+    return _pattern_matchers[key]
+
+
+def contains_pattern(app_name, msg_text, pattern, is_regex=None):
+    return get_pattern_matcher(app_name, pattern, is_regex).search(msg_text)
+
+
+def get_template_text(record):
+    ''' Returns what is clustered of a log message: its level, logger and the message on its first line. '''
+    first_line = record.text.partition("\n")[0]
+    header, separator, message = first_line.partition(" - ")
+    if not separator:
+        message = first_line[log_timestamps.get_timestamp_length(first_line):]
+    return "{0} [{1}] {2}".format(record.level, record.logger, message.strip())
+
+
+class FoundRecords:
+    '''
+        What was found in log files: the matching log messages, except the ones summarized instead. With stack_traces
+        (the number of frames in a fingerprint), the ones with a stack trace are grouped by its fingerprint, and with
+        cluster, the others are summarized as message templates.
+    '''
+
+    def __init__(self, cluster=None, stack_traces=None):
+        self.cluster = cluster
+        self.stack_traces = stack_traces
+        self.records = []
+        self.miner = log_templates.TemplateMiner() if cluster else None
+        self.trace_groups = log_fingerprints.TraceGroups(frame_count=stack_traces) if stack_traces else None
+
+    def new(self):
+        ''' Returns an empty FoundRecords with the same options. '''
+        return FoundRecords(self.cluster, self.stack_traces)
+
+    def add(self, record, found_patterns):
+        if self.trace_groups is not None and self.trace_groups.add(record):
+            return
+        if self.miner is not None:
+            self.miner.add(get_template_text(record), record.timestamp, record.text.partition("\n")[0].rstrip())
+        else:
+            self.records.append((record, found_patterns))
+
+    def merge(self, other):
+        self.records.extend(other.records)
+        if self.miner is not None:
+            self.miner.merge(other.miner.get_templates())
+            self.miner.dropped_count += other.miner.dropped_count
+        if self.trace_groups is not None:
+            self.trace_groups.merge(other.trace_groups)
+
+
+def scan_log_file(app_name, path, start_timestamp, end_timestamp, pattern, is_regex=None, start_offset=None, end_offset=None, found=None):
+    '''
+        Adds the log messages in the file, or byte range of it, that match to found, or to a new FoundRecords, in a
+        single pass. Returns found.
+    '''
+    found = found if found is not None else FoundRecords()
+    matcher = get_pattern_matcher(app_name, pattern, is_regex)
+    for record in logs.iter_records(path, start_timestamp, end_timestamp, start_offset, end_offset):
+        found_patterns = matcher.find_all(record.text)
+        if found_patterns:
+            found.add(record, found_patterns)
+    return found
+
+
+def scan_log_file_in_parallel(executor, workers, app_name, path, start_timestamp, end_timestamp, pattern, is_regex, found):
+    '''
+        Splits the file into byte ranges aligned on log messages and scans each one in a separate process of the
+        executor. The results of the ranges are merged into found in file order, so they are the same as
+        scan_log_file's.
+    '''
+    ranges = logs.get_record_aligned_ranges(path, workers, start_timestamp, end_timestamp)
+    logging.debug("Scanning file {0} in {1} parts: {2}".format(path, len(ranges), ranges))
+    futures = [executor.submit(scan_log_file, app_name, path, start_timestamp, end_timestamp, pattern, is_regex, start_offset, end_offset, found.new())
+               for (start_offset, end_offset) in ranges]
+    for future in futures:
+        found.merge(future.result())
+    return found
+
+
+def report_found_records(path, found_records):
+    if found_records:
+        pattern_counts = collections.Counter()
+        logging.info("\nFound {0} log messages in file {1}\n".format(len(found_records), path))
+        for (record, found_patterns) in found_records:
+            pattern_counts.update(found_patterns)
+            msg_lines = record.lines()
+            logging.info("{0:%Y-%m-%d %H:%M:%S}  {1}".format(record.timestamp, msg_lines[0]))
+            for line in msg_lines[1:]:
+                logging.info("{0}  {1}".format(" " * 19, line))
+        logging.info("")
+        for (name, count) in pattern_counts.most_common():
+            logging.info("Pattern {0!r} found in {1} log messages".format(name, count))
     else:
         logging.info("\nFound NO log messages in file {0}\n".format(path))
 
 
+def report_templates(miner):
+    templates = miner.get_templates()
+    logging.info("\nFound {0} log messages in {1} templates\n".format(sum(template.count for template in templates) + miner.dropped_count, len(templates)))
+    for template in templates[:REPORT_TEMPLATE_COUNT]:
+        logging.info("{0:>8}  {1:%Y-%m-%d %H:%M:%S} to {2:%Y-%m-%d %H:%M:%S}  {3}".format(template.count, template.first_seen, template.last_seen, template.text()))
+        logging.info("{0:>8}  e.g. {1}".format("", template.example))
+    if len(templates) > REPORT_TEMPLATE_COUNT:
+        other_templates = templates[REPORT_TEMPLATE_COUNT:]
+        logging.info("\n... and {0} more templates with {1} log messages".format(len(other_templates), sum(template.count for template in other_templates)))
+    if miner.dropped_count:
+        logging.info("{0} log messages were in templates not seen for a while, which were dropped to bound memory".format(miner.dropped_count))
+
+
+def report_trace_groups(trace_groups):
+    groups = trace_groups.get_groups()
+    logging.info("\nFound {0} log messages with {1} different stack traces\n".format(sum(group.count for group in groups), len(groups)))
+    for group in groups[:REPORT_TRACE_COUNT]:
+        logging.info("{0:>8}  {1:%Y-%m-%d %H:%M:%S} to {2:%Y-%m-%d %H:%M:%S}  fingerprint {3}".format(group.count, group.first_seen, group.last_seen, group.fingerprint))
+        for line in group.signature:
+            logging.info("{0:>8}    {1}".format("", line))
+        logging.info("{0:>8}  e.g. {1}".format("", group.example))
+    if len(groups) > REPORT_TRACE_COUNT:
+        other_groups = groups[REPORT_TRACE_COUNT:]
+        logging.info("\n... and {0} more stack traces in {1} log messages".format(len(other_groups), sum(group.count for group in other_groups)))
+
+
+def check_app_logs(app_name, log_paths, start_timestamp, end_timestamp, pattern, is_regex=None, workers=None, cluster=None, stack_traces=None):
+    '''
+        Reports the log messages in the files that match the pattern. With stack_traces, the number of frames to
+        fingerprint stack traces with, the ones with a stack trace are reported once per fingerprint, and with
+        cluster, the others are reported as message templates, across all the files.
+    '''
+    executor = concurrent.futures.ProcessPoolExecutor(max_workers=workers) if workers and workers > 1 else None
+    found = FoundRecords(cluster, stack_traces)
+    try:
+        for path in log_paths:
+            if not path.exists():
+                logging.info("The expected log file {0} does not exist.".format(path))
+                continue
+            logging.info("\nChecking file {0}".format(path))
+            if executor:
+                scan_log_file_in_parallel(executor, workers, app_name, path, start_timestamp, end_timestamp, pattern, is_regex, found)
+            else:
+                scan_log_file(app_name, path, start_timestamp, end_timestamp, pattern, is_regex, found=found)
+            if not cluster and (found.records or not stack_traces):
+                report_found_records(path, found.records)
+            found.records = []
+    finally:
+        if executor:
+            executor.shutdown()
+    if stack_traces:
+        report_trace_groups(found.trace_groups)
+    if cluster:
+        report_templates(found.miner)
+
+
 if __name__ == "__main__":
     parser = argparse.ArgumentParser()
     parser.add_argument("-v", "--verbose", dest="verbose", action="store_true",
@@ -62,11 +197,19 @@ if __name__ == "__main__":
                         choices=environment.LOG_APP_PATHS.keys(), help="Application name to get logs for")
     parser.add_argument("-p", "--pattern", dest="pattern",
                         help="Pattern to search for. If none provided, then it uses the pattern(s) for the specified application listed in env.py")
+    parser.add_argument("-r", "--regex", dest="is_regex", action="store_true",
+                        help="Flag to treat the pattern given with -p/--pattern as a regular expression instead of a plain substring.")
     parser.add_argument('-t', '--timestamp', dest='start_timestamp', type=logs.valid_datetime_type,
                         default=(datetime.datetime.now() - datetime.timedelta(days=1)),
                         help='Starting Timestamp to get logs for in format "YYYY-MM-DD HH:mm". Use qutes around the timestamp if including hours and minutes. Defaults to one day before now.')
     parser.add_argument('-n', '--end', dest='end_timestamp', type=logs.valid_datetime_type, default=None,
                         help='End Timestamp to get logs for in format "YYYY-MM-DD HH:mm". Use quotes around the timestamp if including hours and minutes. Defaults to 1 day after the starting timestamp or now, whichever comes first.')
+    parser.add_argument("-w", "--workers", dest="workers", type=int, default=1,
+                        help="Number of processes to scan each log file with, each scanning a part of the file. Defaults to 1.")
+    parser.add_argument("-c", "--cluster", dest="cluster", action="store_true",
+                        help="Summarize the log messages found as message templates, with their counts and when they were first and last seen, instead of listing every one.")
+    parser.add_argument("-s", "--stack-traces", dest="stack_traces", type=int, nargs="?", const=log_fingerprints.DEFAULT_FRAME_COUNT,
+                        help="Report the log messages with a Java stack trace once per fingerprint of the trace, made of its exception classes and their top STACK_TRACES frames in the application's code (defaults to {0}).".format(log_fingerprints.DEFAULT_FRAME_COUNT))
     args = parser.parse_args()
     log_level = logging.DEBUG if args.verbose else logging.INFO
 
@@ -86,7 +229,7 @@ if __name__ == "__main__":
         logging.info(
             "\nFound {0} files for the {1} app in the {2} environment for the timeframe of {3:%Y-%m-%d %H:%M:%S.%f} to {4:%Y-%m-%d %H:%M:%S.%f} to check.\n".format(
                 len(log_paths), args.app_name, args.env_name, args.start_timestamp, end_timestamp))
-        check_app_logs(args.app_name, log_paths, args.start_timestamp, end_timestamp, args.pattern)
+        check_app_logs(args.app_name, log_paths, args.start_timestamp, end_timestamp, args.pattern, args.is_regex, args.workers, args.cluster, args.stack_traces)
     else:
         logging.info(
             "Cannot find logs for {0} app in the {1} environment for the timeframe {2} to {3}.".format(args.app_name,
@@ -0,0 +1,153 @@
+import argparse
+import concurrent.futures
+import datetime
+import logging
+
+import numpy as np
+
+import check_app_logs
+import common_utils
+import environment
+import logs
+
+'''
+    Rates over time of the log messages matching a pattern (the application's patterns from
+    environment.APP_LOG_PATTERNS by default), per server, for any number of environments:
+        python check_error_rates.py -a APP1 -t "2020-03-23 00:00" -n "2020-03-30 00:00" -o rates.csv
+    The matching log messages of each log file are counted per minute into a NumPy array indexed by the minute since
+    the start of the period, and the arrays of the files of a server are added together. The result is written as a
+    CSV file with a column per server and shown as an ASCII heatmap with a row per server.
+'''
+
+DEFAULT_HEATMAP_WIDTH = 120
+HEATMAP_SHADES = " .:-=+*#%@"
+COUNT_FLUSH_SIZE = 1000000
+
+
+def floor_to_minute(timestamp):
+    return timestamp.replace(second=0, microsecond=0)
+
+
+def get_minute_count(start_timestamp, end_timestamp):
+    return int((floor_to_minute(end_timestamp) - floor_to_minute(start_timestamp)).total_seconds()) // 60 + 1
+
+
+def count_log_file(app_name, path, start_timestamp, end_timestamp, pattern, is_regex=None):
+    ''' Returns an array of the number of matching log messages in the file in each minute from start to end. '''
+    start_minute = floor_to_minute(start_timestamp)
+    minute_count = get_minute_count(start_timestamp, end_timestamp)
+    counts = np.zeros(minute_count, dtype=np.int64)
+    minutes = []
+    for record in logs.iter_records(path, start_timestamp, end_timestamp):
+        if check_app_logs.contains_pattern(app_name, record.text, pattern, is_regex):
+            minutes.append(int((record.timestamp - start_minute).total_seconds()) // 60)
+            if len(minutes) >= COUNT_FLUSH_SIZE:
+                counts += bin_minutes(minutes, minute_count)
+                minutes = []
+    if minutes:
+        counts += bin_minutes(minutes, minute_count)
+    return counts
+
+
+def bin_minutes(minutes, minute_count):
+    minutes = np.asarray(minutes)
+    # Messages logged out of order can fall outside of the period
+    minutes = minutes[(minutes >= 0) & (minutes < minute_count)]
+    return np.bincount(minutes, minlength=minute_count)
+
+
+def get_error_rates(env_names, app_name, start_timestamp, end_timestamp, pattern=None, is_regex=None, workers=None, force_get=None):
+    '''
+        Returns {(env, server): array of the number of matching log messages in each minute from start to end} for
+        the logs of the app in the environments. The files are counted in parallel in workers processes.
+    '''
+    executor = concurrent.futures.ProcessPoolExecutor(max_workers=workers) if workers and workers > 1 else None
+    futures = []
+    try:
+        for env_name in env_names:
+            try:
+                log_paths = logs.get_logs(env_name, app_name, start_timestamp, end_timestamp, force_get)
+            except Exception as ex:
+                logging.info("Could not get the logs for the {0} app in the {1} environment. Exception {2}".format(app_name, env_name, ex))
+                continue
+            for path in log_paths:
+                key = (env_name, logs.get_server_name(path).rstrip("_") or "-")
+                if executor:
+                    futures.append((key, executor.submit(count_log_file, app_name, path, start_timestamp, end_timestamp, pattern, is_regex)))
+                else:
+                    futures.append((key, count_log_file(app_name, path, start_timestamp, end_timestamp, pattern, is_regex)))
+        rates = {}
+        for (key, future) in futures:
+            counts = future.result() if executor else future
+            rates[key] = rates[key] + counts if key in rates else counts
+    finally:
+        if executor:
+            executor.shutdown()
+    return rates
+
+
+def sum_buckets(counts, bucket_minutes):
+    ''' Returns the counts summed over buckets of bucket_minutes minutes. '''
+    return np.add.reduceat(counts, np.arange(0, len(counts), bucket_minutes)) if len(counts) else counts
+
+
+def write_csv(rates, start_timestamp, bucket_minutes, csv_path):
+    ''' Writes a row per bucket of minutes with matching log messages, and a column per environment and server. '''
+    keys = sorted(rates)
+    table = np.array([sum_buckets(rates[key], bucket_minutes) for key in keys])
+    start_minute = floor_to_minute(start_timestamp)
+    with open(csv_path, "w") as csv_h:
+        csv_h.write("minute,{0}\n".format(",".join("{0}/{1}".format(env_name, server_name) for (env_name, server_name) in keys)))
+        for bucket in np.flatnonzero(table.sum(axis=0)) if len(keys) else []:
+            minute = start_minute + datetime.timedelta(minutes=int(bucket) * bucket_minutes)
+            csv_h.write("{0:%Y-%m-%d %H:%M},{1}\n".format(minute, ",".join(str(count) for count in table[:, bucket])))
+
+
+def get_heatmap(rates, start_timestamp, end_timestamp, width=DEFAULT_HEATMAP_WIDTH):
+    ''' Returns the lines of an ASCII heatmap of the rates, with a row per environment and server. '''
+    keys = sorted(rates)
+    if not keys:
+        return []
+    minute_count = get_minute_count(start_timestamp, end_timestamp)
+    bucket_minutes = -(-minute_count // width)
+    table = np.array([sum_buckets(rates[key], bucket_minutes) for key in keys])
+    peak = table.max()
+    # Any matching message shows as at least the lightest shade
+    shades = np.where(table > 0, 1 + (table * (len(HEATMAP_SHADES) - 2)) // max(peak, 1), 0)
+    label_width = max(len("{0}/{1}".format(*key)) for key in keys)
+    lines = ["{0:{1}}  {2:%Y-%m-%d %H:%M} to {3:%Y-%m-%d %H:%M}, {4} minutes per column, {5} at most per column".format(
+        "", label_width, start_timestamp, end_timestamp, bucket_minutes, peak)]
+    for (key, row, counts) in zip(keys, shades, table):
+        lines.append("{0:{1}} |{2}| {3}".format("{0}/{1}".format(*key), label_width, "".join(HEATMAP_SHADES[shade] for shade in row), counts.sum()))
+    return lines
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Rates over time of the log messages matching a pattern, per server and environment.")
+    parser.add_argument("-v", "--verbose", dest="verbose", action="store_true", help="Flag to print verbose log messages.")
+    parser.add_argument("-e", "--environment", dest="env_names", action="append", choices=environment.LOG_LOCATIONS.keys(),
+                        help="Environment to get logs from. Can be given more than once. Defaults to all the environments.")
+    parser.add_argument("-f", "--force", dest="force_get", action="store_true", help="Force getting logs from the remote location instead of relying on existing local files.")
+    parser.add_argument("-a", "--application", dest="app_name", required=True, choices=environment.LOG_APP_PATHS.keys(), help="Application name to get logs for")
+    parser.add_argument("-p", "--pattern", dest="pattern", help="Pattern to count. If none provided, then it uses the pattern(s) for the specified application listed in env.py")
+    parser.add_argument("-r", "--regex", dest="is_regex", action="store_true", help="Flag to treat the pattern given with -p/--pattern as a regular expression instead of a plain substring.")
+    parser.add_argument('-t', '--timestamp', dest='start_timestamp', type=logs.valid_datetime_type, default=(datetime.datetime.now() - datetime.timedelta(days=1)),
+                        help='Starting Timestamp in format "YYYY-MM-DD HH:mm". Defaults to one day before now.')
+    parser.add_argument('-n', '--end', dest='end_timestamp', type=logs.valid_datetime_type, default=datetime.datetime.now(),
+                        help='End Timestamp in format "YYYY-MM-DD HH:mm". Defaults to now.')
+    parser.add_argument("-b", "--bucket", dest="bucket_minutes", type=int, default=1, help="Number of minutes per row of the CSV file. Defaults to 1.")
+    parser.add_argument("-o", "--output", dest="csv_path", help="CSV file to write the rates to.")
+    parser.add_argument("--width", dest="width", type=int, default=DEFAULT_HEATMAP_WIDTH, help="Number of columns of the heatmap. Defaults to {0}.".format(DEFAULT_HEATMAP_WIDTH))
+    parser.add_argument("-w", "--workers", dest="workers", type=int, default=1, help="Number of processes to count the log files with. Defaults to 1.")
+    args = parser.parse_args()
+    log_level = logging.DEBUG if args.verbose else logging.INFO
+
+    log_file_path = common_utils.get_log_file_path("~/reports", "check_error_rates")
+    common_utils.setup_logger_to_console_file(log_file_path, log_level)
+
+    env_names = args.env_names or list(environment.LOG_LOCATIONS.keys())
+    rates = get_error_rates(env_names, args.app_name, args.start_timestamp, args.end_timestamp, args.pattern, args.is_regex, args.workers, args.force_get)
+    if args.csv_path:
+        write_csv(rates, args.start_timestamp, args.bucket_minutes, args.csv_path)
+        logging.info("\nWrote the rates to {0}".format(args.csv_path))
+    logging.info("\n" + "\n".join(get_heatmap(rates, args.start_timestamp, args.end_timestamp, args.width)))
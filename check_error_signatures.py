@@ -0,0 +1,179 @@
+import argparse
+import collections
+import concurrent.futures
+import datetime
+import hashlib
+import logging
+
+import check_app_logs
+import common_utils
+import environment
+import log_fingerprints
+import log_templates
+import logs
+
+'''
+    Compares the error signatures of an app across environments for the same time period, to find for example the
+    errors that appear in PROD but never showed up in QA or UAT for the same release:
+        python check_error_signatures.py -a APP1 -e PROD -e QA -e UAT -t "2020-03-24 00:00" -n "2020-03-25 00:00"
+    The log messages matching the pattern (the application's patterns from environment.APP_LOG_PATTERNS by default)
+    are scanned like check_app_logs does, and each is reduced to a signature: its level, logger and message with the
+    variable parts masked, and the fingerprint of its stack trace if it has one. Each environment is kept as counts
+    per signature hash, with the text of each signature once, never as log messages.
+    The first environment is compared with the others together: the signatures found only in it, the ones never
+    found in it, and the ones whose share of the matching log messages changed by more than a ratio.
+'''
+
+SIGNATURE_HASH_LENGTH = 12
+DEFAULT_RATIO = 2.0
+REPORT_SIGNATURE_COUNT = 50
+
+
+def get_signature_text(record, frame_count=log_fingerprints.DEFAULT_FRAME_COUNT):
+    ''' Returns the signature of a log message: its masked message, and its stack trace exceptions and fingerprint. '''
+    text = " ".join(log_templates.get_tokens(check_app_logs.get_template_text(record)))
+    lines = record.lines()
+    signature = log_fingerprints.get_signature([lines[0].partition(" - ")[2]] + lines[1:], frame_count=frame_count)
+    if signature:
+        exceptions = [line for line in signature if not line.lstrip().startswith("at ")]
+        text = "{0} | {1} #{2}".format(text, " / ".join(exceptions), log_fingerprints.get_fingerprint(signature))
+    return text
+
+
+class SignatureCounts:
+    '''
+        The number of log messages per signature hash found in log files, with the text of each signature. It is
+        filled by check_app_logs.scan_log_file like its FoundRecords, so it can be used with its parallel scans.
+    '''
+
+    def __init__(self, frame_count=log_fingerprints.DEFAULT_FRAME_COUNT):
+        self.frame_count = frame_count
+        self.counts = collections.Counter()
+        self.texts = {}
+
+    def new(self):
+        return SignatureCounts(self.frame_count)
+
+    def add(self, record, found_patterns):
+        text = get_signature_text(record, self.frame_count)
+        key = hashlib.sha1(text.encode("utf-8")).hexdigest()[:SIGNATURE_HASH_LENGTH]
+        self.counts[key] += 1
+        if key not in self.texts:
+            self.texts[key] = text
+
+    def merge(self, other):
+        self.counts.update(other.counts)
+        for (key, text) in other.texts.items():
+            self.texts.setdefault(key, text)
+
+    def total(self):
+        return sum(self.counts.values())
+
+
+def get_env_signatures(env_name, app_name, start_timestamp, end_timestamp, pattern=None, is_regex=None, executor=None, workers=None, force_get=None,
+                       frame_count=log_fingerprints.DEFAULT_FRAME_COUNT):
+    ''' Returns the SignatureCounts of the log messages of the app in the environment that match the pattern. '''
+    signatures = SignatureCounts(frame_count)
+    log_paths = logs.get_logs(env_name, app_name, start_timestamp, end_timestamp, force_get)
+    logging.info("Scanning {0} log files of the {1} environment".format(len(log_paths), env_name))
+    for path in log_paths:
+        if executor:
+            check_app_logs.scan_log_file_in_parallel(executor, workers, app_name, path, start_timestamp, end_timestamp, pattern, is_regex, signatures)
+        else:
+            check_app_logs.scan_log_file(app_name, path, start_timestamp, end_timestamp, pattern, is_regex, found=signatures)
+    return signatures
+
+
+def compare_signatures(target, baseline, ratio=DEFAULT_RATIO):
+    '''
+        Returns (only in target, only in baseline, changed) lists of signature hashes, the first two by decreasing
+        count and changed as (hash, change) by decreasing change, where change is how many times larger the share of
+        the signature in the matching log messages of target is than in baseline, for changes of more than ratio
+        either way.
+    '''
+    target_total, baseline_total = max(target.total(), 1), max(baseline.total(), 1)
+    only_in_target = [key for (key, count) in target.counts.most_common() if key not in baseline.counts]
+    only_in_baseline = [key for (key, count) in baseline.counts.most_common() if key not in target.counts]
+    changed = []
+    for key in target.counts.keys() & baseline.counts.keys():
+        change = (target.counts[key] / target_total) / (baseline.counts[key] / baseline_total)
+        if change >= ratio or change <= 1 / ratio:
+            changed.append((key, change))
+    changed.sort(key=lambda key_change: -key_change[1])
+    return only_in_target, only_in_baseline, changed
+
+
+def report_signatures(title, keys, signatures):
+    logging.info("\n{0}: {1}\n".format(title, len(keys)))
+    for key in keys[:REPORT_SIGNATURE_COUNT]:
+        logging.info("{0:>8}  {1}  {2}".format(signatures.counts[key], key, signatures.texts[key]))
+    if len(keys) > REPORT_SIGNATURE_COUNT:
+        logging.info("... and {0} more".format(len(keys) - REPORT_SIGNATURE_COUNT))
+
+
+def write_csv(env_signatures, csv_path):
+    ''' Writes a row per signature with its count in each environment. '''
+    texts = {}
+    for signatures in env_signatures.values():
+        texts.update(signatures.texts)
+    with open(csv_path, "w") as csv_h:
+        csv_h.write("signature,{0},text\n".format(",".join(env_signatures)))
+        for (key, text) in sorted(texts.items()):
+            counts = ",".join(str(signatures.counts[key]) for signatures in env_signatures.values())
+            csv_h.write('{0},{1},"{2}"\n'.format(key, counts, text.replace('"', '""')))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compare the error signatures of an application across environments.")
+    parser.add_argument("-v", "--verbose", dest="verbose", action="store_true", help="Flag to print verbose log messages.")
+    parser.add_argument("-e", "--environment", dest="env_names", action="append", required=True, choices=environment.LOG_LOCATIONS.keys(),
+                        help="Environment to compare. Give it at least twice: the first one is compared with the others.")
+    parser.add_argument("-f", "--force", dest="force_get", action="store_true", help="Force getting logs from the remote location instead of relying on existing local files.")
+    parser.add_argument("-a", "--application", dest="app_name", required=True, choices=environment.LOG_APP_PATHS.keys(), help="Application name to get logs for")
+    parser.add_argument("-p", "--pattern", dest="pattern", help="Pattern to search for. If none provided, then it uses the pattern(s) for the specified application listed in env.py")
+    parser.add_argument("-r", "--regex", dest="is_regex", action="store_true", help="Flag to treat the pattern given with -p/--pattern as a regular expression instead of a plain substring.")
+    parser.add_argument('-t', '--timestamp', dest='start_timestamp', type=logs.valid_datetime_type, default=(datetime.datetime.now() - datetime.timedelta(days=1)),
+                        help='Starting Timestamp in format "YYYY-MM-DD HH:mm". Defaults to one day before now.')
+    parser.add_argument('-n', '--end', dest='end_timestamp', type=logs.valid_datetime_type, default=datetime.datetime.now(),
+                        help='End Timestamp in format "YYYY-MM-DD HH:mm". Defaults to now.')
+    parser.add_argument("-s", "--stack-frames", dest="frame_count", type=int, default=log_fingerprints.DEFAULT_FRAME_COUNT,
+                        help="Number of application frames in the fingerprints of stack traces. Defaults to {0}.".format(log_fingerprints.DEFAULT_FRAME_COUNT))
+    parser.add_argument("--ratio", dest="ratio", type=float, default=DEFAULT_RATIO,
+                        help="Report the signatures whose share of the log messages changed by more than this ratio. Defaults to {0}.".format(DEFAULT_RATIO))
+    parser.add_argument("-o", "--output", dest="csv_path", help="CSV file to write the counts of every signature in every environment to.")
+    parser.add_argument("-w", "--workers", dest="workers", type=int, default=1, help="Number of processes to scan each log file with. Defaults to 1.")
+    args = parser.parse_args()
+    log_level = logging.DEBUG if args.verbose else logging.INFO
+
+    log_file_path = common_utils.get_log_file_path("~/reports", "check_error_signatures")
+    common_utils.setup_logger_to_console_file(log_file_path, log_level)
+
+    if len(args.env_names) < 2:
+        parser.error("Give at least two environments to compare.")
+    executor = concurrent.futures.ProcessPoolExecutor(max_workers=args.workers) if args.workers > 1 else None
+    try:
+        env_signatures = {env_name: get_env_signatures(env_name, args.app_name, args.start_timestamp, args.end_timestamp, args.pattern, args.is_regex,
+                                                       executor, args.workers, args.force_get, args.frame_count)
+                          for env_name in args.env_names}
+    finally:
+        if executor:
+            executor.shutdown()
+
+    target_name, baseline_names = args.env_names[0], args.env_names[1:]
+    target = env_signatures[target_name]
+    baseline = SignatureCounts()
+    for baseline_name in baseline_names:
+        baseline.merge(env_signatures[baseline_name])
+    baseline_title = "/".join(baseline_names)
+    for (env_name, signatures) in env_signatures.items():
+        logging.info("{0}: {1} log messages with {2} signatures".format(env_name, signatures.total(), len(signatures.counts)))
+
+    only_in_target, only_in_baseline, changed = compare_signatures(target, baseline, args.ratio)
+    report_signatures("Signatures in {0} never found in {1}".format(target_name, baseline_title), only_in_target, target)
+    report_signatures("Signatures in {0} never found in {1}".format(baseline_title, target_name), only_in_baseline, baseline)
+    logging.info("\nSignatures whose share of the log messages changed by more than {0} times from {1} to {2}: {3}\n".format(args.ratio, baseline_title, target_name, len(changed)))
+    for (key, change) in changed[:REPORT_SIGNATURE_COUNT]:
+        logging.info("{0:>7.1f}x  {1:>8} vs {2:<8}  {3}  {4}".format(change, target.counts[key], baseline.counts[key], key, target.texts[key]))
+    if args.csv_path:
+        write_csv(env_signatures, args.csv_path)
+        logging.info("\nWrote the counts of every signature to {0}".format(args.csv_path))
@@ -6,6 +6,7 @@ import pathlib
 import re
 
 import common_utils
+import log_timestamps
 
 
 def get_md5(file_path):
@@ -28,7 +29,7 @@ def get_file_info(file_path_str):
             "size": file_path.stat().st_size}
 
 
-COMPARE_LINE_PATTERN = re.compile("^(?P<filename>[\w.]+)\s+(?P<size>\d*)\s+(?P<year>\d{4})-(?P<month>\d{2})-(?P<day>\d{2}) (?P<hours>\d{2}):(?P<minutes>\d{2}):(?P<seconds>\d{2})(?P<milliseconds>[0-9]*)\s+(?P<md5>.*)$")
+COMPARE_LINE_PATTERN = re.compile("^(?P<filename>[\w.]+)\s+(?P<size>\d*)\s+(?P<timestamp>\d{4}-\d{2}-\d{2} \d{2}:\d{2}:\d{2})(?P<milliseconds>[0-9]*)\s+(?P<md5>.*)$")
 '''
 check_deployed_versions.py                      2921  2020-04-20 20:55:1587416113   c52ab7f2d025264da3b24ace42afaf16
 '''
@@ -39,16 +40,7 @@ def parse_compare_line(line):
     parts = COMPARE_LINE_PATTERN.match(line)
     if parts:
         gp = parts.groupdict()
-        # logging.info(parts.groupdict())
-        hours = int(gp['hours'])
-        if gp['seconds']:
-            seconds = int(gp['seconds'])
-        else:
-            seconds = 0
-        last_modified = datetime.datetime(int(parts.groupdict()['year']),
-                                          int(parts.groupdict()['month']),
-                                          int(parts.groupdict()['day']),
-                                      hours, int(parts.groupdict()['minutes']), seconds)
+        last_modified = log_timestamps.parse_timestamp(gp['timestamp'])
 
         file_name = gp["filename"]
         md5 = gp["md5"]
@@ -1,11 +1,34 @@
+import argparse
+import collections
+import concurrent.futures
 import csv
 import datetime
 import logging
+import pathlib
 import pprint
 import re
 import string
 
 import common_utils
+import configuration
+import environment
+import log_statistics
+import logs
+import pattern_matcher
+
+# Starts waiting for their finish, at most, and how long before they are given up on
+MAX_PENDING_STARTS = 10000
+PENDING_START_TIMEOUT = datetime.timedelta(hours=1)
+DEFAULT_BUCKET_MINUTES = 60
+# Saturation windows closer together than this are reported as one
+SATURATION_GAP = datetime.timedelta(seconds=1)
+REPORT_WINDOW_COUNT = 50
+# The catalog of the calls to time, ~/log_durations.json unless another file is given
+PATTERN_CATALOG_NAME = "log_durations"
+DEFAULT_PATTERNS = {
+    "getAuthorizedApplicationByAppNumber": {"start": "PL/SQL -- execute getAuthorizedApplicationByAppNumber before succeeds!", "finish": "PL/SQL -- execute getAuthorizedApplicationByAppNumber succeeds!"},
+    # "": {"start": "", "finish": ""},
+    }
 
 
 class DeltaTemplate(string.Template):
@@ -31,9 +54,8 @@ def timedelta_format(tdelta, fmt):
 
 def display_durations(log_entries):
     csv_file_path = "/home/fergusos/reports/check_log_durations_{:%Y%m%d_%H%M%S}.csv".format(datetime.datetime.now())
-    logging.info()
     with open(csv_file_path, 'w', newline='') as csvfile:
-        writer = csv.DictWriter(csvfile, fieldnames=["pattern_key", "start", "finish", "duration"], extrasaction="ignore")
+        writer = csv.DictWriter(csvfile, fieldnames=["pattern_key", "server", "thread", "start", "finish", "duration"], extrasaction="ignore")
         writer.writeheader()
         for dur_key in log_entries.keys():
             logging.info("\nDurations for {0}\n".format(dur_key))
@@ -45,66 +67,523 @@ def display_durations(log_entries):
                 else:
                     logging.info("{:%Y-%m-%d %H:%M:%S.%f}   No apparent finish time!".format(entry["start"]))
     logging.info("\nWrote to csv file {}".format(csv_file_path))
-    
 
-def is_pattern_in_line(patterns, line):
-    for (key, pat) in patterns.items():
-        if pat["start"] in line or pat["finish"] in line:
-            return key
-    return None
 
-def convert_to_datetime(date_str):
+class DurationSummary:
     '''
-    Expecting a string containing a date in the format of 2019-12-04 11:08:57,131    
+        Streaming statistics of the durations of each pattern, overall and per bucket of bucket_minutes minutes of
+        their start, which do not keep the durations. Summaries of several files or servers merge into one.
+    '''
+
+    def __init__(self, bucket_minutes=DEFAULT_BUCKET_MINUTES):
+        self.bucket_minutes = bucket_minutes
+        self.patterns = {}
+        self.buckets = {}
+
+    def get_bucket(self, start):
+        minutes = start.hour * 60 + start.minute
+        return datetime.datetime.combine(start.date(), datetime.time()) + datetime.timedelta(minutes=minutes - minutes % self.bucket_minutes)
+
+    def get_stats(self, pat_key, start):
+        bucket_key = (pat_key, self.get_bucket(start))
+        if pat_key not in self.patterns:
+            self.patterns[pat_key] = log_statistics.DurationStats()
+        if bucket_key not in self.buckets:
+            self.buckets[bucket_key] = log_statistics.DurationStats()
+        return (self.patterns[pat_key], self.buckets[bucket_key])
+
+    def add(self, pat_key, start, finish=None):
+        for stats in self.get_stats(pat_key, start):
+            if finish:
+                stats.add(datetime.timedelta.total_seconds(finish - start))
+            else:
+                stats.add_unfinished()
+
+    def merge(self, other):
+        for (own, others) in [(self.patterns, other.patterns), (self.buckets, other.buckets)]:
+            for (key, stats) in others.items():
+                if key not in own:
+                    own[key] = log_statistics.DurationStats()
+                own[key].merge(stats)
+
+
+def format_seconds(seconds):
+    return "{:.3f}".format(seconds) if seconds is not None else ""
+
+
+def get_stats_row(stats):
+    return [stats.count, stats.unfinished_count, format_seconds(stats.minimum), format_seconds(stats.mean())] + \
+        [format_seconds(stats.quantile(q)) for q in log_statistics.DEFAULT_QUANTILES] + [format_seconds(stats.maximum)]
+
+
+def display_statistics(summary):
+    csv_file_path = "/home/fergusos/reports/check_log_durations_stats_{:%Y%m%d_%H%M%S}.csv".format(datetime.datetime.now())
+    quantile_names = ["p{:g}".format(q * 100) for q in log_statistics.DEFAULT_QUANTILES]
+    header = ["Count", "No finish", "Min", "Mean"] + quantile_names + ["Max"]
+    row_format = "{:<17}" + " {:>10}" * len(header)
+    with open(csv_file_path, 'w', newline='') as csvfile:
+        writer = csv.writer(csvfile)
+        writer.writerow(["pattern_key", "bucket"] + [name.lower().replace(" ", "_") for name in header])
+        for pat_key in summary.patterns:
+            logging.info("\nDuration statistics in seconds for {0}\n".format(pat_key))
+            logging.info(row_format.format("Start time", *header))
+            logging.info(row_format.format("All", *get_stats_row(summary.patterns[pat_key])))
+            writer.writerow([pat_key, ""] + get_stats_row(summary.patterns[pat_key]))
+            for (bucket_key, stats) in sorted(summary.buckets.items()):
+                if bucket_key[0] == pat_key:
+                    logging.info(row_format.format("{:%Y-%m-%d %H:%M}".format(bucket_key[1]), *get_stats_row(stats)))
+                    writer.writerow([pat_key, "{:%Y-%m-%d %H:%M}".format(bucket_key[1])] + get_stats_row(stats))
+    logging.info("\nWrote to csv file {}".format(csv_file_path))
+
+
+class ConcurrencySweep:
+    '''
+        The +1 and -1 events of the start and finish of each call of each pattern, to find how many calls were in
+        flight at any moment. Starts with no finish are counted apart, as when they ended is not known.
+    '''
+
+    def __init__(self):
+        self.events = {}
+        self.unfinished_counts = collections.Counter()
+
+    def add(self, pat_key, start, finish=None):
+        if not finish:
+            self.unfinished_counts[pat_key] += 1
+            return
+        if pat_key not in self.events:
+            self.events[pat_key] = []
+        self.events[pat_key].extend([(start, 1), (finish, -1)])
+
+    def merge(self, other):
+        for (pat_key, events) in other.events.items():
+            self.events.setdefault(pat_key, []).extend(events)
+        self.unfinished_counts.update(other.unfinished_counts)
+
+
+def get_concurrency(events, saturation=None):
+    '''
+        Sweeps the events in time order and returns (max in flight, when it was first reached, [(first second,
+        last second, max in flight)] runs of seconds with the same maximum number of calls in flight, [(start, end,
+        max in flight)] windows with at least saturation calls in flight, or the max if saturation is None).
+    '''
+    # A call that finishes when another starts is not counted with it
+    events = sorted(events)
+    max_in_flight, max_timestamp, in_flight = 0, None, 0
+    for (timestamp, change) in events:
+        in_flight += change
+        if in_flight > max_in_flight:
+            max_in_flight, max_timestamp = in_flight, timestamp
+    saturation = saturation or max_in_flight
+
+    runs, windows = [], []
+    def add_run(first_second, last_second, second_max):
+        if runs and runs[-1][2] == second_max and runs[-1][1] + datetime.timedelta(seconds=1) == first_second:
+            runs[-1] = (runs[-1][0], last_second, second_max)
+        else:
+            runs.append((first_second, last_second, second_max))
+
+    second, second_max, in_flight, window = None, 0, 0, None
+    for (timestamp, change) in events:
+        event_second = timestamp.replace(microsecond=0)
+        if event_second != second:
+            if second:
+                add_run(second, second, second_max)
+                if event_second - second > datetime.timedelta(seconds=1):
+                    add_run(second + datetime.timedelta(seconds=1), event_second - datetime.timedelta(seconds=1), in_flight)
+            second, second_max = event_second, in_flight
+        in_flight += change
+        second_max = max(second_max, in_flight)
+        if in_flight >= saturation:
+            if not window:
+                if windows and timestamp - windows[-1][1] < SATURATION_GAP:
+                    window = list(windows.pop())
+                else:
+                    window = [timestamp, None, 0]
+            window[2] = max(window[2], in_flight)
+        elif window:
+            window[1] = timestamp
+            windows.append(tuple(window))
+            window = None
+    if second:
+        add_run(second, second, second_max)
+    return (max_in_flight, max_timestamp, runs, windows)
+
+
+def display_concurrency(sweep, pool_size=None):
+    csv_file_path = "/home/fergusos/reports/check_log_durations_concurrency_{:%Y%m%d_%H%M%S}.csv".format(datetime.datetime.now())
+    with open(csv_file_path, 'w', newline='') as csvfile:
+        writer = csv.writer(csvfile)
+        writer.writerow(["kind", "pattern_key", "start", "end", "in_flight"])
+        for pat_key in sorted(sweep.events.keys() | sweep.unfinished_counts.keys()):
+            (max_in_flight, max_timestamp, runs, windows) = get_concurrency(sweep.events.get(pat_key, []), pool_size)
+            logging.info("\nConcurrency for {0}\n".format(pat_key))
+            logging.info("Calls: {0}, with no apparent finish time and not counted: {1}".format(len(sweep.events.get(pat_key, [])) // 2, sweep.unfinished_counts[pat_key]))
+            if not max_timestamp:
+                continue
+            logging.info("Max in flight: {0}, first at {1:%Y-%m-%d %H:%M:%S.%f}".format(max_in_flight, max_timestamp))
+            saturated = sum((end - start for (start, end, window_max) in windows), datetime.timedelta())
+            logging.info("Windows with at least {0} in flight: {1}, for {2:.3f} seconds in all\n".format(pool_size or max_in_flight, len(windows), saturated.total_seconds()))
+            for (start, end, window_max) in windows[:REPORT_WINDOW_COUNT]:
+                logging.info("{:%Y-%m-%d %H:%M:%S.%f} to {:%H:%M:%S.%f}   {:>8.3f}s   max {}".format(start, end, (end - start).total_seconds(), window_max))
+            if len(windows) > REPORT_WINDOW_COUNT:
+                logging.info("... and {0} more".format(len(windows) - REPORT_WINDOW_COUNT))
+            for (first_second, last_second, second_max) in runs:
+                writer.writerow(["in_flight", pat_key, "{:%Y-%m-%d %H:%M:%S}".format(first_second), "{:%Y-%m-%d %H:%M:%S}".format(last_second), second_max])
+            for (start, end, window_max) in windows:
+                writer.writerow(["saturated", pat_key, "{:%Y-%m-%d %H:%M:%S.%f}".format(start)[:-3], "{:%Y-%m-%d %H:%M:%S.%f}".format(end)[:-3], window_max])
+    logging.info("\nWrote to csv file {}".format(csv_file_path))
+
+
+def get_pattern_catalog(catalog_path=None):
+    '''
+        Returns the patterns of the calls to time from a JSON catalog file, or from ~/log_durations.json if none is
+        given and else DEFAULT_PATTERNS. The catalog is like:
+            {"getAuthorizedApplicationByAppNumber": {"start": "execute getAuthorizedApplicationByAppNumber before succeeds!",
+                                                     "finish": "execute getAuthorizedApplicationByAppNumber succeeds!",
+                                                     "correlation": "appNumber=(\\d+)"}}
+        where start and finish are pattern_matcher patterns, substrings or dicts like {"regex": ...}, and correlation
+        is optional. Returns None if the given file cannot be loaded.
+    '''
+    if not catalog_path:
+        default_path = pathlib.Path("~", PATTERN_CATALOG_NAME + "." + configuration.CONFIGURATION_TYPE_JSON).expanduser()
+        if not default_path.is_file():
+            logging.debug("No pattern catalog at {0}, using the default patterns".format(default_path))
+            return DEFAULT_PATTERNS
+        return configuration.get_configuration(PATTERN_CATALOG_NAME, None, configuration.CONFIGURATION_TYPE_JSON) or DEFAULT_PATTERNS
+    catalog_path = pathlib.Path(catalog_path)
+    return configuration.get_configuration(catalog_path.stem, catalog_path.parent, configuration.CONFIGURATION_TYPE_JSON)
+
+
+def get_duration_matcher(patterns):
+    '''
+        Returns a PatternMatcher finding the start or finish of any of the patterns in a single scan of a line, whose
+        names are (pattern key, "start" or "finish").
+    '''
+    events = []
+    for (pat_key, pattern) in patterns.items():
+        for event in ("start", "finish"):
+            if isinstance(pattern[event], dict):
+                events.append(dict(pattern[event], name=(pat_key, event)))
+            else:
+                events.append({"substring": pattern[event], "name": (pat_key, event)})
+    return pattern_matcher.PatternMatcher(events)
+
+
+class PendingStarts:
+    '''
+        The starts waiting for their finish, keyed on (pattern key, thread or correlation ID), so the calls of an
+        operation running on many threads at once are each paired with their own finish. At most max_size starts are
+        kept, and a start older than timeout is given up on, as its finish was not logged.
+    '''
+
+    def __init__(self, max_size=MAX_PENDING_STARTS, timeout=PENDING_START_TIMEOUT):
+        self.max_size = max_size
+        self.timeout = timeout
+        # Oldest start first
+        self.starts = collections.OrderedDict()
+
+    def add(self, key, timestamp):
+        ''' Adds a start. Returns the [(key, start)] given up on: an earlier start with the same key and the evicted ones. '''
+        unfinished = []
+        previous = self.starts.pop(key, None)
+        if previous:
+            unfinished.append((key, previous))
+        self.starts[key] = timestamp
+        while len(self.starts) > self.max_size or next(iter(self.starts.values())) < timestamp - self.timeout:
+            unfinished.append(self.starts.popitem(last=False))
+        return unfinished
+
+    def pop(self, key):
+        return self.starts.pop(key, None)
+
+    def pop_all(self):
+        unfinished = list(self.starts.items())
+        self.starts.clear()
+        return unfinished
+
+
+def get_pairing_key(pat_key, pattern, match):
+    '''
+        Returns what pairs a start with its finish: the first group of the "correlation" regular expression of the
+        pattern in the message if it has one and it is found, else the thread.
+    '''
+    if pattern.get("correlation"):
+        correlation = re.search(pattern["correlation"], match.group(5))
+        if correlation:
+            return (pat_key, correlation.group(1))
+    return (pat_key, match.group(3).lstrip("["))
+
+
+def add_log_entry(log_entries, key, start, finish=None, summary=None):
+    (pat_key, thread) = key
+    if summary is not None:
+        summary.add(pat_key, start, finish)
+    if log_entries is None:
+        return
+    if pat_key not in log_entries:
+        log_entries[pat_key] = []
+    log_entries[pat_key].append({"pattern_key": pat_key, "thread": thread, "start": start, "finish": finish,
+                                 "duration": datetime.timedelta.total_seconds(finish - start) if finish else None})
+
+
+def scan_durations(patterns, file_path, start_timestamp=None, end_timestamp=None, log_entries=None, summary=None,
+                   max_pending=MAX_PENDING_STARTS, pending_timeout=PENDING_START_TIMEOUT):
+    '''
+        Pairs the starts and finishes of the patterns in the log messages of the file between start_timestamp and
+        end_timestamp, adding the durations to log_entries and to summary if given. Returns (the PendingStarts left
+        at the end of the file, {key: first finish} of the keys that finished before starting in the file, the keys
+        that started in the file, the timestamps of the first and last log messages), to pair them across rotated
+        files. A start carried over from an earlier file is given up on after pending_timeout, so only the keys and
+        finishes within pending_timeout of the first log message are kept for that.
     '''
-    return datetime.datetime.strptime(date_str, "%Y-%m-%d %H:%M:%S,%f")
-    
-def get_log_entries(patterns, file_path):
-    # log_entries = [] # array of dicts {"pattern_key": "<string>", "start": <Datetime>, "finish": <Datetime>}
-    log_entries = {} # dict of array of dicts {"pattern_key": ["<string>", "start": <Datetime>, "finish": <Datetime>]}
     PARSE_PATTERN = re.compile("^(\d{4}-\d{2}-\d{2} \d{2}:\d{2}:\d{2},\d{3}) (DEBUG|INFO|WARN|ERROR)\s(\[\w* : \d*)\]\s(\[[\w.]*\]) - (.*)$")
-    with open(file_path) as file:
-        last_starts = {}
-        for line in file:
-            pat_key = is_pattern_in_line(patterns, line)
-            if pat_key:
-                match = PARSE_PATTERN.match(line)
-                if match:
-                    if patterns[pat_key]["start"] in match.group():
-                        if last_starts.get(pat_key):                            
-                            if pat_key not in log_entries:
-                                log_entries[pat_key] = []
-                            log_entries[pat_key].append({"pattern_key": pat_key, "start": last_starts[pat_key], "finish": None, "duration": None})
-                            del last_starts[pat_key]
-                        last_starts[pat_key] = convert_to_datetime(match.group(1))
+    pending_starts = PendingStarts(max_pending, pending_timeout)
+    leading_finishes = {}
+    started_keys = set()
+    first_timestamp = last_timestamp = carried_until = None
+    matcher = get_duration_matcher(patterns)
+    for record in logs.iter_records(file_path, start_timestamp, end_timestamp):
+        if not first_timestamp:
+            first_timestamp = record.timestamp
+            carried_until = first_timestamp + pending_timeout
+        last_timestamp = record.timestamp
+        is_leading = record.timestamp <= carried_until
+        # Only the first line of a log message starts with its timestamp
+        line = record.text.partition("\n")[0]
+        found = matcher.find_first(line)
+        if found:
+            (pat_key, event) = found
+            match = PARSE_PATTERN.match(line)
+            if match:
+                key = get_pairing_key(pat_key, patterns[pat_key], match)
+                if event == "start":
+                    if is_leading:
+                        started_keys.add(key)
+                    for (unfinished_key, start) in pending_starts.add(key, record.timestamp):
+                        add_log_entry(log_entries, unfinished_key, start, summary=summary)
+                else:
+                    start = pending_starts.pop(key)
+                    if start:
+                        add_log_entry(log_entries, key, start, record.timestamp, summary)
+                    elif is_leading and key not in started_keys and key not in leading_finishes:
+                        leading_finishes[key] = record.timestamp
                     else:
-                        if pat_key not in log_entries:
-                            log_entries[pat_key] = []
-                        finish_timestamp = convert_to_datetime(match.group(1))
-                        log_entries[pat_key].append({"pattern_key": pat_key, "start": last_starts[pat_key], "finish": finish_timestamp, "duration": datetime.timedelta.total_seconds(finish_timestamp - last_starts[pat_key])})
-                        del last_starts[pat_key]
-    for (key, val) in last_starts.items():
-        if val:
-            if key not in log_entries:
-                log_entries[key] = []
-            log_entries[key].append({"pattern_key": key, "start": val, "finish": None, "duration": None})
-    return log_entries
-
-
-def main(log_file_path):
-    patterns = {
-        "getAuthorizedApplicationByAppNumber": {"start": "PL/SQL -- execute getAuthorizedApplicationByAppNumber before succeeds!", "finish": "PL/SQL -- execute getAuthorizedApplicationByAppNumber succeeds!"},
-        # "": {"start": "", "finish": ""},
-        }
-    log_entries = get_log_entries(patterns, log_file_path)
-    display_durations(log_entries)
+                        logging.debug("No start for the finish of {0} on {1} at {2:%Y-%m-%d %H:%M:%S.%f}".format(pat_key, key[1], record.timestamp))
+    return (pending_starts, leading_finishes, started_keys, first_timestamp, last_timestamp)
+
+
+def get_log_entries(patterns, file_path, max_pending=MAX_PENDING_STARTS, pending_timeout=PENDING_START_TIMEOUT, summary=None):
+    ''' Returns the durations found in the file, or adds them to summary instead if one is given, a DurationSummary or ConcurrencySweep. '''
+    # log_entries = [] # array of dicts {"pattern_key": "<string>", "start": <Datetime>, "finish": <Datetime>}
+    log_entries = {} if summary is None else None # dict of array of dicts {"pattern_key": ["<string>", "thread": "<string>", "start": <Datetime>, "finish": <Datetime>]}
+    (pending_starts, leading_finishes, started_keys, first_timestamp, last_timestamp) = scan_durations(
+        patterns, file_path, log_entries=log_entries, summary=summary, max_pending=max_pending, pending_timeout=pending_timeout)
+    for (key, finish) in leading_finishes.items():
+        logging.debug("No start for the finish of {0} on {1} at {2:%Y-%m-%d %H:%M:%S.%f}".format(key[0], key[1], finish))
+    for (key, start) in pending_starts.pop_all():
+        add_log_entry(log_entries, key, start, summary=summary)
+    return log_entries if log_entries is not None else {}
+
+
+class ServerDurations:
+    '''
+        The durations found in log files of a server: their DurationSummary, and as well every duration as
+        get_log_entries returns them if keep_entries, or their ConcurrencySweep if concurrency. It is the summary of
+        scan_durations, and the durations it is given are added to all of them.
+    '''
+
+    def __init__(self, server, bucket_minutes=DEFAULT_BUCKET_MINUTES, keep_entries=True, concurrency=False):
+        self.server = server
+        self.summary = DurationSummary(bucket_minutes)
+        self.log_entries = {} if keep_entries else None
+        self.sweep = ConcurrencySweep() if concurrency else None
+
+    def add(self, pat_key, start, finish=None):
+        self.summary.add(pat_key, start, finish)
+        if self.sweep:
+            self.sweep.add(pat_key, start, finish)
+
+    def add_log_entry(self, key, start, finish=None):
+        add_log_entry(self.log_entries, key, start, finish, self)
+        if self.log_entries is not None:
+            self.log_entries[key[0]][-1]["server"] = self.server
+
+    def merge(self, other):
+        self.summary.merge(other.summary)
+        if self.sweep:
+            self.sweep.merge(other.sweep)
+        if self.log_entries is not None:
+            for (pat_key, entries) in other.log_entries.items():
+                for entry in entries:
+                    entry["server"] = self.server
+                self.log_entries.setdefault(pat_key, []).extend(entries)
+
+
+class FileDurations:
+    ''' What scan_durations found in one log file of a server, with what is needed to pair it with the files before and after it. '''
+
+    def __init__(self, path, durations, pending_starts, leading_finishes, started_keys, first_timestamp, last_timestamp):
+        self.path = path
+        self.durations = durations
+        self.pending_starts = pending_starts
+        self.leading_finishes = leading_finishes
+        self.started_keys = started_keys
+        self.first_timestamp = first_timestamp
+        self.last_timestamp = last_timestamp
+
+    def get_time_order(self):
+        # Files without log messages in the time period have nothing to pair
+        return (self.first_timestamp or datetime.datetime.max, self.last_timestamp or datetime.datetime.max)
+
+
+def get_file_durations(patterns, path, start_timestamp, end_timestamp, bucket_minutes=DEFAULT_BUCKET_MINUTES, keep_entries=True, concurrency=False,
+                       max_pending=MAX_PENDING_STARTS, pending_timeout=PENDING_START_TIMEOUT):
+    ''' Returns the FileDurations of one log file. Runs in a worker process. '''
+    durations = ServerDurations(logs.get_server_name(path).rstrip("_") or "-", bucket_minutes, keep_entries, concurrency)
+    (pending_starts, leading_finishes, started_keys, first_timestamp, last_timestamp) = scan_durations(
+        patterns, path, start_timestamp, end_timestamp, durations.log_entries, durations, max_pending, pending_timeout)
+    return FileDurations(path, durations, pending_starts.pop_all(), leading_finishes, started_keys, first_timestamp, last_timestamp)
+
+
+def merge_file_durations(file_durations, server_durations, max_pending=MAX_PENDING_STARTS, pending_timeout=PENDING_START_TIMEOUT):
+    '''
+        Merges the FileDurations of the files of a server into its ServerDurations, in time order. The starts left
+        pending at the end of a file are paired with the finishes at the start of the next files that had no start
+        in them, as if the files had been read as one: a start is given up on when its key starts again first.
+    '''
+    carried_starts = PendingStarts(max_pending, pending_timeout)
+    for file_result in sorted(file_durations, key=FileDurations.get_time_order):
+        for (key, finish) in file_result.leading_finishes.items():
+            start = carried_starts.pop(key)
+            if start:
+                server_durations.add_log_entry(key, start, finish)
+            else:
+                logging.debug("No start for the finish of {0} on {1} at {2:%Y-%m-%d %H:%M:%S.%f}".format(key[0], key[1], finish))
+        for key in file_result.started_keys:
+            start = carried_starts.pop(key)
+            if start:
+                server_durations.add_log_entry(key, start)
+        for (key, start) in file_result.pending_starts:
+            for (unfinished_key, unfinished_start) in carried_starts.add(key, start):
+                server_durations.add_log_entry(unfinished_key, unfinished_start)
+        server_durations.merge(file_result.durations)
+    for (key, start) in carried_starts.pop_all():
+        server_durations.add_log_entry(key, start)
+    return server_durations
+
+
+def get_server_durations(env_name, app_name, start_timestamp, end_timestamp, patterns, bucket_minutes=DEFAULT_BUCKET_MINUTES, keep_entries=True,
+                         concurrency=False, workers=None, force_get=None):
+    '''
+        Returns {server: ServerDurations} for the log files of the app in the environment between the timestamps,
+        from logs.get_logs, whose files are each scanned in one of workers processes.
+    '''
+    log_paths = logs.get_logs(env_name, app_name, start_timestamp, end_timestamp, force_get)
+    logging.info("\nFound {0} files for the {1} app in the {2} environment to check durations from.".format(len(log_paths), app_name, env_name))
+    executor = concurrent.futures.ProcessPoolExecutor(max_workers=workers) if workers and workers > 1 else None
+    try:
+        if executor:
+            futures = [executor.submit(get_file_durations, patterns, path, start_timestamp, end_timestamp, bucket_minutes, keep_entries, concurrency)
+                       for path in log_paths]
+            file_results = [future.result() for future in futures]
+        else:
+            file_results = [get_file_durations(patterns, path, start_timestamp, end_timestamp, bucket_minutes, keep_entries, concurrency) for path in log_paths]
+    finally:
+        if executor:
+            executor.shutdown()
+    server_files = {}
+    for file_result in file_results:
+        server_files.setdefault(file_result.durations.server, []).append(file_result)
+    return {server: merge_file_durations(server_files[server], ServerDurations(server, bucket_minutes, keep_entries, concurrency))
+            for server in sorted(server_files)}
+
+
+def display_server_summary(server_durations):
+    ''' Logs the count, min, mean, percentiles and max of the durations of each pattern on each server. '''
+    quantile_names = ["p{:g}".format(q * 100) for q in log_statistics.DEFAULT_QUANTILES]
+    header = ["Count", "No finish", "Min", "Mean"] + quantile_names + ["Max"]
+    row_format = "{:<17}" + " {:>10}" * len(header)
+    pat_keys = sorted(set(pat_key for durations in server_durations.values() for pat_key in durations.summary.patterns))
+    for pat_key in pat_keys:
+        logging.info("\nDuration statistics in seconds for {0} per server\n".format(pat_key))
+        logging.info(row_format.format("Server", *header))
+        for (server, durations) in server_durations.items():
+            if pat_key in durations.summary.patterns:
+                logging.info(row_format.format(server, *get_stats_row(durations.summary.patterns[pat_key])))
+
+
+def write_durations(log_entries):
+    ''' Writes the durations of all the servers to one CSV file, in order of their start. '''
+    csv_file_path = "/home/fergusos/reports/check_log_durations_{:%Y%m%d_%H%M%S}.csv".format(datetime.datetime.now())
+    with open(csv_file_path, 'w', newline='') as csvfile:
+        writer = csv.DictWriter(csvfile, fieldnames=["pattern_key", "server", "thread", "start", "finish", "duration"], extrasaction="ignore")
+        writer.writeheader()
+        for dur_key in log_entries.keys():
+            writer.writerows(sorted(log_entries[dur_key], key=lambda entry: entry["start"]))
+    logging.info("\nWrote to csv file {}".format(csv_file_path))
+
+
+def check_server_durations(env_name, app_name, start_timestamp, end_timestamp, patterns, statistics=False, bucket_minutes=DEFAULT_BUCKET_MINUTES,
+                           concurrency=False, pool_size=None, workers=None, force_get=None):
+    server_durations = get_server_durations(env_name, app_name, start_timestamp, end_timestamp, patterns, bucket_minutes,
+                                            not statistics and not concurrency, concurrency, workers, force_get)
+    total = ServerDurations("all", bucket_minutes, not statistics and not concurrency, concurrency)
+    for durations in server_durations.values():
+        total.summary.merge(durations.summary)
+        if total.sweep:
+            total.sweep.merge(durations.sweep)
+        if total.log_entries is not None:
+            for (pat_key, entries) in durations.log_entries.items():
+                total.log_entries.setdefault(pat_key, []).extend(entries)
+    if statistics:
+        display_statistics(total.summary)
+    elif concurrency:
+        display_concurrency(total.sweep, pool_size)
+    else:
+        write_durations(total.log_entries)
+    display_server_summary(server_durations)
+
+
+def main(log_file_path, statistics=False, bucket_minutes=DEFAULT_BUCKET_MINUTES, concurrency=False, pool_size=None, patterns=None):
+    patterns = patterns or DEFAULT_PATTERNS
+    if statistics:
+        summary = DurationSummary(bucket_minutes)
+        get_log_entries(patterns, log_file_path, summary=summary)
+        display_statistics(summary)
+    elif concurrency:
+        sweep = ConcurrencySweep()
+        get_log_entries(patterns, log_file_path, summary=sweep)
+        display_concurrency(sweep, pool_size)
+    else:
+        log_entries = get_log_entries(patterns, log_file_path)
+        display_durations(log_entries)
 
     
 if __name__ == "__main__":
 
     parser = argparse.ArgumentParser()
     parser.add_argument("-v", "--verbose", dest="verbose", action="store_true", help="Flag to print verbose log messages.")
-    parser.add_argument(dest='log_file_path', help='Log file to check durations from.')
+    parser.add_argument("-s", "--statistics", dest="statistics", action="store_true",
+                        help="Flag to show the count, min, mean, percentiles and max of the durations instead of each one, in fixed memory.")
+    parser.add_argument("-b", "--bucket", dest="bucket_minutes", type=int, default=DEFAULT_BUCKET_MINUTES,
+                        help="Number of minutes of the time buckets of the statistics. Defaults to {0}.".format(DEFAULT_BUCKET_MINUTES))
+    parser.add_argument("-c", "--concurrency", dest="concurrency", action="store_true",
+                        help="Flag to show how many calls were in flight at any moment instead of the durations, and when they saturated --pool-size.")
+    parser.add_argument("--pool-size", dest="pool_size", type=int,
+                        help="Number of calls in flight from which they are saturated, like the size of a connection pool. Defaults to the max in flight.")
+    parser.add_argument("-p", "--patterns", dest="catalog_path",
+                        help="JSON catalog of the start and finish patterns of the calls to time. Defaults to ~/{0}.json if it exists.".format(PATTERN_CATALOG_NAME))
+    parser.add_argument(dest='log_file_path', nargs="?", help='Log file to check durations from, instead of the logs of an environment.')
+    parser.add_argument("-e", "--environment", dest="env_name", choices=environment.LOG_LOCATIONS.keys(), help="Environment name to get logs from")
+    parser.add_argument("-a", "--application", dest="app_name", choices=environment.LOG_APP_PATHS.keys(), help="Application name to get logs for")
+    parser.add_argument("-f", "--force", dest="force_get", action="store_true",
+                        help="Force getting logs from the remote location instead of relying on existing local files.")
+    parser.add_argument('-t', '--timestamp', dest='start_timestamp', type=logs.valid_datetime_type, default=(datetime.datetime.now() - datetime.timedelta(days=1)),
+                        help='Starting Timestamp to get logs for in format "YYYY-MM-DD HH:mm". Defaults to one day before now.')
+    parser.add_argument('-n', '--end', dest='end_timestamp', type=logs.valid_datetime_type, default=datetime.datetime.now(),
+                        help='End Timestamp to get logs for in format "YYYY-MM-DD HH:mm". Defaults to now.')
+    parser.add_argument("-w", "--workers", dest="workers", type=int, default=1,
+                        help="Number of processes to scan the log files of the environment with, one file each at a time. Defaults to 1.")
     args = parser.parse_args()
 
     log_level = logging.DEBUG if args.verbose else logging.INFO
@@ -112,6 +591,15 @@ if __name__ == "__main__":
     output_file_path = common_utils.get_log_file_path("/home/fergusos/reports", "check_log_durations")
     common_utils.setup_logger_to_console_file(output_file_path, log_level)
 
-    main(args.log_file_path)
+    patterns = get_pattern_catalog(args.catalog_path)
+    if not patterns:
+        parser.error("Could not load the patterns from {0}".format(args.catalog_path))
+    if args.log_file_path:
+        main(args.log_file_path, args.statistics, args.bucket_minutes, args.concurrency, args.pool_size, patterns)
+    elif args.env_name and args.app_name:
+        check_server_durations(args.env_name, args.app_name, args.start_timestamp, args.end_timestamp, patterns, args.statistics, args.bucket_minutes,
+                               args.concurrency, args.pool_size, args.workers, args.force_get)
+    else:
+        parser.error("Give a log file, or an environment and an application to get the logs of.")
 
     logging.info('\n\nLog file: {}'.format(output_file_path))
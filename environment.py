@@ -16,6 +16,8 @@ PYTHON_WORKSPACE_PATH = "/cygdrive/c/dev/project1/python_workspace"
 
 
 LOCAL_LOG_DIRECTORY = "/cygdrive/c/dev/logs"
+COMPRESS_LOCAL_LOGS = True
+''' Store downloaded logs in LOCAL_LOG_DIRECTORY compressed. See log_store.py. Existing plain copies can be compressed with logs.py -z '''
 
 
 LOG_LOCATIONS = {
@@ -40,6 +42,7 @@ LOG_APP_PATHS = {
                     "SERVICE2": ["/apps/servvice2/logs/service2.log"],
                 }
 
+# Patterns are plain substrings, or dicts like {"regex": "ORA-\\d{5}", "name": "oracle errors"} - see pattern_matcher.py
 APP_LOG_PATTERNS = {
                         "APP1": ["ERROR"],
                         "APP2": ["ERROR"],
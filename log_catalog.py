@@ -0,0 +1,153 @@
+import calendar
+import datetime
+import logging
+import pathlib
+import sqlite3
+
+import environment
+
+CATALOG_FILE_NAME = "log_catalog.sqlite"
+
+KIND_DOWNLOADED = "downloaded"
+KIND_EXTRACTED = "extracted"
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS log_files (
+    path TEXT PRIMARY KEY,
+    env TEXT NOT NULL,
+    app TEXT NOT NULL,
+    server TEXT,
+    kind TEXT NOT NULL,
+    start INTEGER NOT NULL,
+    end INTEGER NOT NULL,
+    size INTEGER
+);
+CREATE INDEX IF NOT EXISTS log_files_window ON log_files (env, app, kind, start);
+CREATE TABLE IF NOT EXISTS log_spans (
+    env TEXT NOT NULL,
+    app TEXT NOT NULL,
+    kind TEXT NOT NULL,
+    max_span INTEGER NOT NULL,
+    PRIMARY KEY (env, app, kind)
+);
+CREATE TABLE IF NOT EXISTS scanned_dirs (
+    env TEXT NOT NULL,
+    app TEXT NOT NULL,
+    mtime_ns INTEGER NOT NULL,
+    PRIMARY KEY (env, app)
+);
+'''
+'''
+    Catalog of the local copies of log files, so finding the files overlapping a time window is an indexed lookup
+    instead of a scan of LOCAL_LOG_DIRECTORY. Times are stored as seconds since the epoch of the naive log timestamps.
+
+    The overlap lookup is done on the start column only: a file overlaps [start, end] if it starts before end and
+    after start - <longest file span for the env/app>. The longest span is kept in the log_spans table so the query
+    is a range scan of the (env, app, kind, start) index.
+
+    The scanned_dirs table keeps the modification time of the local log directory of an env/app when its files were
+    last added to the catalog, so files put there any other way than by a download are found once it changes.
+'''
+
+
+def to_epoch(timestamp):
+    return calendar.timegm(timestamp.timetuple())
+
+
+def from_epoch(seconds):
+    return datetime.datetime(1970, 1, 1) + datetime.timedelta(seconds=seconds)
+
+
+def get_catalog_path():
+    return pathlib.Path(environment.LOCAL_LOG_DIRECTORY, CATALOG_FILE_NAME)
+
+
+def get_connection():
+    catalog_path = get_catalog_path()
+    catalog_path.parent.mkdir(parents=True, exist_ok=True)
+    connection = sqlite3.connect(str(catalog_path), timeout=30)
+    connection.executescript(SCHEMA)
+    return connection
+
+
+def add_log_file(env_name, app_name, server_name, start, end, path, kind=KIND_DOWNLOADED):
+    path = pathlib.Path(path)
+    size = path.stat().st_size if path.exists() else None
+    span = to_epoch(end) - to_epoch(start)
+    connection = get_connection()
+    try:
+        with connection:
+            connection.execute("INSERT OR REPLACE INTO log_files (path, env, app, server, kind, start, end, size) VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                               (str(path), env_name, app_name, server_name, kind, to_epoch(start), to_epoch(end), size))
+            connection.execute("INSERT INTO log_spans (env, app, kind, max_span) VALUES (?, ?, ?, ?) "
+                               "ON CONFLICT (env, app, kind) DO UPDATE SET max_span = MAX(max_span, excluded.max_span)",
+                               (env_name, app_name, kind, span))
+    finally:
+        connection.close()
+    logging.debug("Added {0} log file {1} for {2} to {3} to the catalog".format(kind, path, start, end))
+
+
+def remove_log_file(path):
+    connection = get_connection()
+    try:
+        with connection:
+            connection.execute("DELETE FROM log_files WHERE path = ?", (str(path),))
+    finally:
+        connection.close()
+
+
+def get_log_file_paths(env_name, app_name, kind=KIND_DOWNLOADED):
+    connection = get_connection()
+    try:
+        rows = connection.execute("SELECT path FROM log_files WHERE env = ? AND app = ? AND kind = ?", (env_name, app_name, kind)).fetchall()
+    finally:
+        connection.close()
+    return {path for (path,) in rows}
+
+
+def get_scanned_mtime(env_name, app_name):
+    ''' Returns the modification time of the local log directory of the env/app when it was last scanned, or None. '''
+    connection = get_connection()
+    try:
+        row = connection.execute("SELECT mtime_ns FROM scanned_dirs WHERE env = ? AND app = ?", (env_name, app_name)).fetchone()
+    finally:
+        connection.close()
+    return row[0] if row else None
+
+
+def set_scanned_mtime(env_name, app_name, mtime_ns):
+    connection = get_connection()
+    try:
+        with connection:
+            connection.execute("INSERT OR REPLACE INTO scanned_dirs (env, app, mtime_ns) VALUES (?, ?, ?)", (env_name, app_name, mtime_ns))
+    finally:
+        connection.close()
+
+
+def find_log_files(env_name, app_name, start, end=None, kind=KIND_DOWNLOADED):
+    '''
+        Returns a list of dicts {"path", "server", "start", "end", "size"} for the catalogued files that overlap the
+        time window start to end, ordered by start time and server. Files that no longer exist are dropped from the
+        catalog.
+    '''
+    end = end or start
+    connection = get_connection()
+    try:
+        row = connection.execute("SELECT max_span FROM log_spans WHERE env = ? AND app = ? AND kind = ?", (env_name, app_name, kind)).fetchone()
+        if not row:
+            return []
+        rows = connection.execute("SELECT path, server, start, end, size FROM log_files "
+                                  "WHERE env = ? AND app = ? AND kind = ? AND start BETWEEN ? AND ? AND end >= ? "
+                                  "ORDER BY start, server",
+                                  (env_name, app_name, kind, to_epoch(start) - row[0], to_epoch(end), to_epoch(start))).fetchall()
+        found = []
+        for (path, server, file_start, file_end, size) in rows:
+            if pathlib.Path(path).exists():
+                found.append({"path": pathlib.Path(path), "server": server, "start": from_epoch(file_start), "end": from_epoch(file_end), "size": size})
+            else:
+                logging.debug("Removing log file {0} from the catalog as it no longer exists".format(path))
+                with connection:
+                    connection.execute("DELETE FROM log_files WHERE path = ?", (path,))
+    finally:
+        connection.close()
+    return found
@@ -0,0 +1,99 @@
+import hashlib
+import re
+
+import environment
+
+'''
+    Fingerprints of the Java stack traces in log messages, so the same failure logged thousands of times is reported
+    once with a count. A fingerprint is a stable hash of the exception classes of the stack trace and its "Caused by"
+    chain, with the top frames of each that are in the application's own code (the classes under
+    environment.GROUP_ID_BASE), or the top frames of any code when none are. Exception messages and line numbers are
+    left out, as they change from one occurrence or one release to the next.
+'''
+
+EXCEPTION_LINE_PATTERN = re.compile(r"^\s*(?P<caused_by>Caused by:\s*)?(?P<exception>(?:[a-zA-Z_$][\w$]*\.)+[A-Z][\w$]*(?:Exception|Error|Throwable)[\w$]*)(?::|\s*$)")
+# Numbers in the names of generated classes, like $$Lambda$123/0x00000008001c4c40 or GeneratedMethodAccessor45
+GENERATED_NAME_PATTERN = re.compile(r"(?:(?<=\$)|(?<=Accessor)|(?<=Proxy))\d+|/0x[0-9a-fA-F]+")
+DEFAULT_FRAME_COUNT = 5
+FINGERPRINT_LENGTH = 12
+
+
+def parse_exception_chain(lines):
+    ''' Returns [(exception class, [frame methods])] for the exception of the stack trace in the lines and its causes. '''
+    chain = []
+    for line in lines:
+        # Frames are most of the lines, so they are recognized without a regular expression
+        stripped = line.lstrip()
+        if stripped.startswith("at "):
+            if chain:
+                chain[-1][1].append(stripped[3:].partition("(")[0].strip())
+            continue
+        exception = EXCEPTION_LINE_PATTERN.match(line)
+        if exception and (exception.group("caused_by") or not chain):
+            chain.append((exception.group("exception"), []))
+    return chain
+
+
+def get_signature(lines, package_prefix=environment.GROUP_ID_BASE, frame_count=DEFAULT_FRAME_COUNT):
+    ''' Returns the lines of the signature of the stack trace in the lines, which identifies it, or None if it has none. '''
+    chain = parse_exception_chain(lines)
+    if not any(frames for (exception, frames) in chain):
+        return None
+    signature = []
+    for (position, (exception, frames)) in enumerate(chain):
+        signature.append("{0}{1}".format("Caused by: " if position else "", exception))
+        app_frames = [frame for frame in frames if frame.startswith(package_prefix)] if package_prefix else []
+        signature.extend("    at {0}".format(GENERATED_NAME_PATTERN.sub("", frame)) for frame in (app_frames or frames)[:frame_count])
+    return signature
+
+
+def get_fingerprint(signature):
+    return hashlib.sha1("\n".join(signature).encode("utf-8")).hexdigest()[:FINGERPRINT_LENGTH]
+
+
+class TraceGroup:
+    ''' The log messages with the same stack trace fingerprint: how many, when they were first and last seen and an example. '''
+    __slots__ = ("fingerprint", "signature", "count", "first_seen", "last_seen", "example")
+
+    def __init__(self, fingerprint, signature, count, first_seen, last_seen, example):
+        self.fingerprint = fingerprint
+        self.signature = signature
+        self.count = count
+        self.first_seen = first_seen
+        self.last_seen = last_seen
+        self.example = example
+
+
+class TraceGroups:
+
+    def __init__(self, package_prefix=environment.GROUP_ID_BASE, frame_count=DEFAULT_FRAME_COUNT):
+        self.package_prefix = package_prefix
+        self.frame_count = frame_count
+        self.groups = {}
+
+    def add_group(self, fingerprint, signature, count, first_seen, last_seen, example):
+        group = self.groups.get(fingerprint)
+        if group:
+            group.count += count
+            group.first_seen = min(group.first_seen, first_seen)
+            group.last_seen = max(group.last_seen, last_seen)
+        else:
+            self.groups[fingerprint] = TraceGroup(fingerprint, signature, count, first_seen, last_seen, example)
+
+    def add(self, record):
+        ''' Adds the log message to the group of its stack trace. Returns False if it has no stack trace. '''
+        lines = record.lines()
+        # The exception can also be the message itself, on the first line
+        signature = get_signature([lines[0].partition(" - ")[2]] + lines[1:], self.package_prefix, self.frame_count)
+        if not signature:
+            return False
+        self.add_group(get_fingerprint(signature), signature, 1, record.timestamp, record.timestamp, lines[0])
+        return True
+
+    def merge(self, other):
+        for group in other.groups.values():
+            self.add_group(group.fingerprint, group.signature, group.count, group.first_seen, group.last_seen, group.example)
+
+    def get_groups(self):
+        ''' Returns the groups, the ones with the most log messages first. '''
+        return sorted(self.groups.values(), key=lambda group: (-group.count, group.first_seen))
@@ -0,0 +1,132 @@
+import bisect
+import collections
+import datetime
+import json
+import logging
+import os
+import pathlib
+import tempfile
+
+'''
+    Sidecar index of a local log file, kept next to it in <name>.log.index (or <name>.log.gz.index):
+        {"version": 1, "size": <file size>, "mtime_ns": <file modification time>, "every": SAMPLE_EVERY,
+         "samples": [[<record offset>, <record timestamp>], ...],
+         "minutes": {"2020-03-26T14:07": {"DEBUG": 1520, "ERROR": 2}, ...},
+         "levels": {"DEBUG": 98200, "ERROR": 35, ...}}
+    The samples are the offset and timestamp of every SAMPLE_EVERY-th log message, so a reader can start at the last
+    sample before a timestamp. The per-minute and per-level counts of the log messages answer summary questions, like
+    the number of ERROR messages from 14:00 to 14:10, without reading the log file.
+    Offsets are in the uncompressed content for compressed log files. The index is only valid for the size and
+    modification time of the file it was built from, and is ignored once the file changes.
+'''
+
+INDEX_SUFFIX = ".index"
+INDEX_VERSION = 1
+SAMPLE_EVERY = 1000
+MINUTE_FORMAT = "%Y-%m-%dT%H:%M"
+
+
+def get_index_path(path):
+    return pathlib.Path(str(path) + INDEX_SUFFIX)
+
+
+def get_file_signature(path):
+    stat = os.stat(path)
+    return stat.st_size, stat.st_mtime_ns
+
+
+class IndexBuilder:
+    '''
+        Builds the index of a log file from all its log messages, given in file order to add(). Given the index of
+        the file from before more was appended to it, only the appended log messages need to be added.
+    '''
+
+    def __init__(self, path, index=None):
+        self.path = path
+        self.size, self.mtime_ns = get_file_signature(path)
+        self.count = 0
+        self.samples = []
+        self.minutes = collections.defaultdict(collections.Counter)
+        self.levels = collections.Counter()
+        if index:
+            self.samples = [list(sample) for sample in index["samples"]]
+            for (minute, levels) in index["minutes"].items():
+                self.minutes[minute].update(levels)
+            self.levels.update(index["levels"])
+            self.count = sum(self.levels.values())
+
+    def add(self, record):
+        if self.count % SAMPLE_EVERY == 0:
+            self.samples.append([record.offset, record.timestamp.isoformat()])
+        self.count += 1
+        self.minutes[record.timestamp.strftime(MINUTE_FORMAT)][record.level] += 1
+        self.levels[record.level] += 1
+
+    def get_index(self):
+        return {"version": INDEX_VERSION, "size": self.size, "mtime_ns": self.mtime_ns, "every": SAMPLE_EVERY,
+                "samples": self.samples, "minutes": self.minutes, "levels": self.levels}
+
+    def save(self):
+        ''' Writes the index and returns it, unless the log file changed while it was being read. '''
+        if get_file_signature(self.path) != (self.size, self.mtime_ns):
+            logging.debug("Not saving the index of {0} as it changed while being indexed".format(self.path))
+            return None
+        index = self.get_index()
+        index_path = get_index_path(self.path)
+        # Processes scanning parts of the same file can be saving its index at the same time
+        with tempfile.NamedTemporaryFile("w", dir=index_path.parent, prefix=index_path.name, suffix=".tmp", delete=False) as index_h:
+            try:
+                json.dump(index, index_h)
+            except Exception:
+                index_h.close()
+                os.unlink(index_h.name)
+                raise
+        os.replace(index_h.name, index_path)
+        logging.debug("Saved the index of {0} log messages of {1}".format(self.count, self.path))
+        return index
+
+
+def load_index(path):
+    ''' Returns the index of the log file, or None if it has none or the file changed since it was built. '''
+    index_path = get_index_path(path)
+    if not index_path.exists():
+        return None
+    try:
+        with open(index_path, "r") as index_h:
+            index = json.load(index_h)
+    except ValueError:
+        logging.debug("Ignoring the unreadable index {0}".format(index_path))
+        return None
+    if index.get("version") != INDEX_VERSION or get_file_signature(path) != (index["size"], index["mtime_ns"]):
+        logging.debug("Ignoring the index of {0} as the file changed since it was built".format(path))
+        return None
+    return index
+
+
+def delete_index(path):
+    index_path = get_index_path(path)
+    if index_path.exists():
+        index_path.unlink()
+
+
+def find_offset_for_timestamp(index, timestamp):
+    ''' Returns the offset of the last sampled log message before the timestamp, to start reading at, or 0. '''
+    timestamps = [datetime.datetime.fromisoformat(sample[1]) for sample in index["samples"]]
+    position = bisect.bisect_left(timestamps, timestamp) - 1
+    return index["samples"][position][0] if position >= 0 else 0
+
+
+def count_levels(index, start=None, end=None):
+    '''
+        Returns a Counter of the log messages by level in the minutes from the one of start to the one of end. The
+        counts are per minute, so messages in the same minute as start or end but outside the period are included.
+    '''
+    if not start and not end:
+        return collections.Counter(index["levels"])
+    first_minute = start.strftime(MINUTE_FORMAT) if start else ""
+    last_minute = end.strftime(MINUTE_FORMAT) if end else "9999"
+    counts = collections.Counter()
+    for (minute, levels) in index["minutes"].items():
+        if first_minute <= minute <= last_minute:
+            counts.update(levels)
+    return counts
@@ -0,0 +1,228 @@
+import argparse
+import datetime
+import hashlib
+import logging
+import pathlib
+import sqlite3
+import time
+
+import common_utils
+import environment
+import log_store
+import logs
+
+SEARCH_FILE_NAME = "log_search.sqlite"
+HEAD_SIZE = 4096
+DEFAULT_LIMIT = 100
+DEFAULT_WATCH_SECONDS = 300
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS search_files (
+    id INTEGER PRIMARY KEY,
+    path TEXT UNIQUE NOT NULL,
+    env TEXT NOT NULL,
+    app TEXT NOT NULL,
+    server TEXT,
+    head_length INTEGER NOT NULL,
+    head_hash TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    resume_offset INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS search_records (
+    id INTEGER PRIMARY KEY,
+    file_id INTEGER NOT NULL,
+    offset INTEGER NOT NULL,
+    timestamp TEXT NOT NULL,
+    level TEXT
+);
+CREATE INDEX IF NOT EXISTS search_records_file ON search_records (file_id, offset);
+CREATE INDEX IF NOT EXISTS search_records_time ON search_records (timestamp);
+CREATE VIRTUAL TABLE IF NOT EXISTS search_text USING fts5(text, tokenize = "unicode61 tokenchars '_'");
+'''
+'''
+    Full-text index of the log messages of the local copies of log files in LOCAL_LOG_DIRECTORY, in an SQLite FTS5
+    table, so token and phrase queries across all environments and apps do not have to read the log files:
+        python log_search.py -i                      ingest the new files and the new ends of the files
+        python log_search.py -w 300                  keep ingesting every 5 minutes, to run in the background
+        python log_search.py -q '"ORA-00060"' -e PROD -l ERROR -t "2020-03-24 06:00"
+    Queries use the FTS5 syntax: words, "quoted phrases", AND/OR/NOT and prefix* searches.
+
+    The text of each log message is in search_text, under the same rowid as its timestamp, level and offset in
+    search_records. Ingest is incremental: search_files keeps, for each file, how much of it was read and the offset
+    of its last log message, which is read again as it may not have been complete. A file whose start changed is
+    ingested again from the beginning, and one renamed by an incremental sync (same start, new name) is picked up
+    where it was left.
+'''
+
+
+def get_search_path():
+    return pathlib.Path(environment.LOCAL_LOG_DIRECTORY, SEARCH_FILE_NAME)
+
+
+def get_connection():
+    search_path = get_search_path()
+    search_path.parent.mkdir(parents=True, exist_ok=True)
+    connection = sqlite3.connect(str(search_path), timeout=30)
+    # Queries can run while the watcher is ingesting
+    connection.execute("PRAGMA journal_mode=WAL")
+    connection.executescript(SCHEMA)
+    return connection
+
+
+def get_head_hash(path, length):
+    with log_store.open_log(path) as log_h:
+        return hashlib.sha1(log_h.read(length)).hexdigest()
+
+
+def find_moved_file(connection, env_name, app_name, server_name, path):
+    ''' Returns the row of an ingested file of the server that no longer exists and has the same start as path. '''
+    rows = connection.execute("SELECT id, head_length, head_hash, size, resume_offset, path FROM search_files WHERE env = ? AND app = ? AND server IS ?",
+                              (env_name, app_name, server_name)).fetchall()
+    for row in rows:
+        if not pathlib.Path(row[5]).exists() and get_head_hash(path, row[1]) == row[2]:
+            logging.debug("Log file {0} was ingested as {1}".format(path, row[5]))
+            return row
+    return None
+
+
+def delete_records(connection, file_id, offset=0):
+    connection.execute("DELETE FROM search_text WHERE rowid IN (SELECT id FROM search_records WHERE file_id = ? AND offset >= ?)", (file_id, offset))
+    connection.execute("DELETE FROM search_records WHERE file_id = ? AND offset >= ?", (file_id, offset))
+
+
+def ingest_file(connection, env_name, app_name, server_name, path):
+    ''' Adds the log messages of the file that are not in the index yet. Returns how many were added. '''
+    size = log_store.get_log_size(path)
+    row = connection.execute("SELECT id, head_length, head_hash, size, resume_offset FROM search_files WHERE path = ?", (str(path),)).fetchone()
+    if not row:
+        row = find_moved_file(connection, env_name, app_name, server_name, path)
+        if row:
+            with connection:
+                connection.execute("UPDATE search_files SET path = ? WHERE id = ?", (str(path), row[0]))
+    if row and (size < row[3] or get_head_hash(path, row[1]) != row[2]):
+        logging.debug("Log file {0} changed, so ingesting it again".format(path))
+        with connection:
+            delete_records(connection, row[0])
+            connection.execute("DELETE FROM search_files WHERE id = ?", (row[0],))
+        row = None
+    if row and size == row[3]:
+        return 0
+
+    head_length = min(size, HEAD_SIZE)
+    head_hash = get_head_hash(path, head_length)
+    count = 0
+    with connection:
+        if row:
+            file_id, offset = row[0], row[4]
+            delete_records(connection, file_id, offset)
+        else:
+            file_id = connection.execute("INSERT INTO search_files (path, env, app, server, head_length, head_hash, size, resume_offset) VALUES (?, ?, ?, ?, ?, ?, ?, 0)",
+                                         (str(path), env_name, app_name, server_name, head_length, head_hash, size)).lastrowid
+            offset = 0
+        resume_offset = offset
+        with log_store.open_log(path, offset) as log_h:
+            for record in logs.read_records(log_h, offset):
+                record_id = connection.execute("INSERT INTO search_records (file_id, offset, timestamp, level) VALUES (?, ?, ?, ?)",
+                                               (file_id, record.offset, record.timestamp.isoformat(timespec="milliseconds"), record.level)).lastrowid
+                connection.execute("INSERT INTO search_text (rowid, text) VALUES (?, ?)", (record_id, record.text))
+                resume_offset = record.offset
+                count += 1
+        connection.execute("UPDATE search_files SET head_length = ?, head_hash = ?, size = ?, resume_offset = ? WHERE id = ?",
+                           (head_length, head_hash, size, resume_offset, file_id))
+    logging.debug("Ingested {0} log messages from {1}".format(count, path))
+    return count
+
+
+def get_local_log_files(env_name=None, app_name=None):
+    ''' Yields (env, app, server, path) for the local copies of log files, not including the extracted ones. '''
+    for env_dir in sorted(pathlib.Path(environment.LOCAL_LOG_DIRECTORY).glob(env_name or "*")):
+        for app_dir in sorted(env_dir.glob(app_name or "*")):
+            if not app_dir.is_dir():
+                continue
+            for log_path in sorted(list(app_dir.glob("*.log")) + list(app_dir.glob("*.log" + log_store.COMPRESSED_SUFFIX))):
+                if logs.FILENAME_PATTERN.match(log_path.name):
+                    yield env_dir.name, app_dir.name, logs.get_server_name(log_path).rstrip("_") or None, log_path
+
+
+def ingest(env_name=None, app_name=None):
+    ''' Ingests the new local log files and the new ends of the others, and drops the deleted ones. '''
+    connection = get_connection()
+    count = 0
+    try:
+        for (log_env_name, log_app_name, server_name, log_path) in get_local_log_files(env_name, app_name):
+            count += ingest_file(connection, log_env_name, log_app_name, server_name, log_path)
+        for (file_id, path) in connection.execute("SELECT id, path FROM search_files").fetchall():
+            if not pathlib.Path(path).exists():
+                logging.debug("Removing deleted log file {0} from the search index".format(path))
+                with connection:
+                    delete_records(connection, file_id)
+                    connection.execute("DELETE FROM search_files WHERE id = ?", (file_id,))
+    finally:
+        connection.close()
+    return count
+
+
+def watch(interval_seconds, env_name=None, app_name=None):
+    ''' Ingests every interval_seconds until interrupted. '''
+    while True:
+        count = ingest(env_name, app_name)
+        logging.info("Ingested {0} new log messages".format(count))
+        time.sleep(interval_seconds)
+
+
+def search(query, env_name=None, app_name=None, server_name=None, level=None, start=None, end=None, limit=DEFAULT_LIMIT):
+    '''
+        Returns up to limit dicts {"timestamp", "env", "app", "server", "level", "path", "offset", "text"} for the log
+        messages matching the FTS5 query and the other criteria, most recent first.
+    '''
+    sql = ("SELECT r.timestamp, f.env, f.app, f.server, r.level, f.path, r.offset, t.text FROM search_text t "
+           "JOIN search_records r ON r.id = t.rowid JOIN search_files f ON f.id = r.file_id WHERE search_text MATCH ?")
+    parameters = [query]
+    for (condition, value) in [("f.env = ?", env_name), ("f.app = ?", app_name), ("f.server = ?", server_name), ("r.level = ?", level),
+                               ("r.timestamp >= ?", start.isoformat(timespec="milliseconds") if start else None),
+                               ("r.timestamp <= ?", end.isoformat(timespec="milliseconds") if end else None)]:
+        if value:
+            sql += " AND " + condition
+            parameters.append(value)
+    sql += " ORDER BY r.timestamp DESC LIMIT ?"
+    parameters.append(limit)
+    connection = get_connection()
+    try:
+        rows = connection.execute(sql, parameters).fetchall()
+    finally:
+        connection.close()
+    return [{"timestamp": datetime.datetime.fromisoformat(row[0]), "env": row[1], "app": row[2], "server": row[3], "level": row[4],
+             "path": pathlib.Path(row[5]), "offset": row[6], "text": row[7]} for row in rows]
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Full-text search of the local copies of the log files.")
+    parser.add_argument("-v", "--verbose", dest="verbose", action="store_true", help="Flag to print verbose log messages.")
+    parser.add_argument("-i", "--ingest", dest="ingest", action="store_true", help="Add the new local log files, and what was added to the others, to the search index.")
+    parser.add_argument("-w", "--watch", dest="watch_seconds", type=int, nargs="?", const=DEFAULT_WATCH_SECONDS,
+                        help="Keep ingesting the local log files every WATCH_SECONDS seconds (defaults to {0}).".format(DEFAULT_WATCH_SECONDS))
+    parser.add_argument("-q", "--query", dest="query", help='FTS5 query, like: "ORA-00060" AND getAuthorizedApplication')
+    parser.add_argument("-e", "--environment", dest="env_name", choices=environment.LOG_LOCATIONS.keys(), help="Only ingest or search the logs of this environment.")
+    parser.add_argument("-a", "--application", dest="app_name", choices=environment.LOG_APP_PATHS.keys(), help="Only ingest or search the logs of this application.")
+    parser.add_argument("-s", "--server", dest="server_name", help="Only search the logs of this server.")
+    parser.add_argument("-l", "--level", dest="level", help="Only search log messages of this level, like ERROR.")
+    parser.add_argument('-t', '--timestamp', dest='start_timestamp', type=logs.valid_datetime_type, help='Only search log messages from this timestamp, in format "YYYY-MM-DD HH:mm".')
+    parser.add_argument('-n', '--end', dest='end_timestamp', type=logs.valid_datetime_type, help='Only search log messages up to this timestamp, in format "YYYY-MM-DD HH:mm".')
+    parser.add_argument("--limit", dest="limit", type=int, default=DEFAULT_LIMIT, help="Maximum number of log messages to show. Defaults to {0}.".format(DEFAULT_LIMIT))
+    args = parser.parse_args()
+    log_level = logging.DEBUG if args.verbose else logging.INFO
+
+    log_file_path = common_utils.get_log_file_path("/home/fergusos/reports", "log_search")
+    common_utils.setup_logger_to_console_file(log_file_path, log_level)
+
+    if args.ingest:
+        count = ingest(args.env_name, args.app_name)
+        logging.info("\nIngested {0} new log messages.".format(count))
+    if args.query:
+        found = search(args.query, args.env_name, args.app_name, args.server_name, args.level, args.start_timestamp, args.end_timestamp, args.limit)
+        logging.info("\nFound {0} log messages matching {1}:\n".format(len(found), args.query))
+        for log_msg in found:
+            logging.info("{0} {1} {2} {3} {4}:{5}\n{6}".format(log_msg["timestamp"], log_msg["env"], log_msg["app"], log_msg["server"] or "-",
+                                                             log_msg["path"].name, log_msg["offset"], log_msg["text"].rstrip()))
+    if args.watch_seconds:
+        watch(args.watch_seconds, args.env_name, args.app_name)
@@ -0,0 +1,108 @@
+import math
+
+'''
+    Streaming statistics of durations, in fixed memory and mergeable, so the durations in a month of logs from many
+    files and servers can be summarized as count, min, max, mean and percentiles without keeping them.
+    Percentiles come from a DDSketch (Masson et al., "DDSketch: A Fast and Fully-Mergeable Quantile Sketch with
+    Relative-Error Guarantees", VLDB 2019): durations are counted in bins whose bounds grow geometrically by gamma,
+    so any percentile is within relative_accuracy of the real one, and two sketches merge by adding their bins.
+'''
+
+DEFAULT_RELATIVE_ACCURACY = 0.01
+DEFAULT_MAX_BINS = 2048
+# Durations are in seconds, so anything under a microsecond is counted as zero
+MIN_VALUE = 1e-6
+DEFAULT_QUANTILES = (0.5, 0.95, 0.99)
+
+
+class QuantileSketch:
+
+    def __init__(self, relative_accuracy=DEFAULT_RELATIVE_ACCURACY, max_bins=DEFAULT_MAX_BINS):
+        self.relative_accuracy = relative_accuracy
+        self.max_bins = max_bins
+        self.gamma = (1 + relative_accuracy) / (1 - relative_accuracy)
+        self.log_gamma = math.log(self.gamma)
+        self.bins = {}
+        self.zero_count = 0
+        self.count = 0
+
+    def add(self, value, count=1):
+        self.count += count
+        if value < MIN_VALUE:
+            self.zero_count += count
+            return
+        index = math.ceil(math.log(value) / self.log_gamma)
+        self.bins[index] = self.bins.get(index, 0) + count
+        if len(self.bins) > self.max_bins:
+            self.collapse()
+
+    def collapse(self):
+        ''' Merges the lowest bins, so the high percentiles keep their accuracy. '''
+        indexes = sorted(self.bins)
+        excess = len(indexes) - self.max_bins
+        collapsed = sum(self.bins.pop(index) for index in indexes[:excess])
+        self.bins[indexes[excess]] += collapsed
+
+    def merge(self, other):
+        if other.gamma != self.gamma:
+            raise ValueError("Cannot merge sketches of different relative accuracies {0} and {1}".format(self.relative_accuracy, other.relative_accuracy))
+        self.count += other.count
+        self.zero_count += other.zero_count
+        for (index, count) in other.bins.items():
+            self.bins[index] = self.bins.get(index, 0) + count
+        if len(self.bins) > self.max_bins:
+            self.collapse()
+
+    def quantile(self, q):
+        ''' Returns the value at quantile q, between 0 and 1, or None if the sketch is empty. '''
+        if not self.count:
+            return None
+        rank = q * (self.count - 1)
+        seen = self.zero_count
+        if seen > rank:
+            return 0.0
+        for index in sorted(self.bins):
+            seen += self.bins[index]
+            if seen > rank:
+                return 2 * self.gamma ** index / (self.gamma + 1)
+        return 2 * self.gamma ** max(self.bins) / (self.gamma + 1)
+
+
+class DurationStats:
+    ''' Count, min, max, mean and percentiles of durations, and the number of starts with no finish. '''
+
+    def __init__(self, relative_accuracy=DEFAULT_RELATIVE_ACCURACY):
+        self.count = 0
+        self.unfinished_count = 0
+        self.minimum = None
+        self.maximum = None
+        self.total = 0.0
+        self.sketch = QuantileSketch(relative_accuracy)
+
+    def add(self, duration):
+        self.count += 1
+        self.total += duration
+        self.minimum = duration if self.minimum is None else min(self.minimum, duration)
+        self.maximum = duration if self.maximum is None else max(self.maximum, duration)
+        self.sketch.add(duration)
+
+    def add_unfinished(self):
+        self.unfinished_count += 1
+
+    def merge(self, other):
+        self.count += other.count
+        self.unfinished_count += other.unfinished_count
+        self.total += other.total
+        for value in (other.minimum, other.maximum):
+            if value is not None:
+                self.minimum = value if self.minimum is None else min(self.minimum, value)
+                self.maximum = value if self.maximum is None else max(self.maximum, value)
+        self.sketch.merge(other.sketch)
+
+    def mean(self):
+        return self.total / self.count if self.count else None
+
+    def quantile(self, q):
+        value = self.sketch.quantile(q)
+        # The sketch is only accurate within its relative accuracy, which can go past the actual extremes
+        return min(max(value, self.minimum), self.maximum) if value is not None else None
@@ -0,0 +1,184 @@
+import bisect
+import datetime
+import gzip
+import json
+import pathlib
+
+import log_timestamps
+
+'''
+    Compressed storage of local log files. A log is stored as <name>.log.gz made of independent gzip members
+    ("frames") of about FRAME_SIZE uncompressed bytes each, which together are still a valid gzip file. Frames are cut
+    just before a line starting with a timestamp, so each starts with a log message. A small frame index is kept
+    next to it in <name>.log.gz.frames:
+        {"size": <uncompressed size>, "frames": [[<uncompressed offset>, <compressed offset>, <first timestamp>], ...]}
+    so a reader can start decompressing at the frame holding a timestamp or an offset instead of at the beginning.
+    Frames appended by an incremental sync can start in the middle of a log message, and have no timestamp.
+'''
+
+COMPRESSED_SUFFIX = ".gz"
+FRAME_INDEX_SUFFIX = ".frames"
+FRAME_SIZE = 4 * 1024 * 1024
+READ_BUFFER_SIZE = 1024 * 1024
+
+
+def is_compressed(path):
+    return str(path).endswith(COMPRESSED_SUFFIX)
+
+
+def get_frame_index_path(path):
+    return pathlib.Path(str(path) + FRAME_INDEX_SUFFIX)
+
+
+def read_frame_index(path):
+    with open(get_frame_index_path(path), "r") as index_h:
+        return json.load(index_h)
+
+
+def get_log_size(path):
+    ''' Returns the uncompressed size of the log file. '''
+    if is_compressed(path):
+        return read_frame_index(path)["size"]
+    return pathlib.Path(path).stat().st_size
+
+
+def rename_log(path, new_path):
+    pathlib.Path(path).replace(new_path)
+    if is_compressed(path):
+        get_frame_index_path(path).replace(get_frame_index_path(new_path))
+
+
+def delete_log(path):
+    pathlib.Path(path).unlink()
+    if is_compressed(path) and get_frame_index_path(path).exists():
+        get_frame_index_path(path).unlink()
+
+
+class CompressedLogWriter:
+    '''
+        File-like object that compresses what is written to it into frames. write() and tell() work on uncompressed
+        bytes, so it can be used in place of a plain binary log file. If append is True, new frames are added after
+        the existing ones of the file.
+    '''
+
+    def __init__(self, path, append=False):
+        self.path = pathlib.Path(path)
+        if append:
+            index = read_frame_index(self.path)
+            self.frames = index["frames"]
+            self.offset = index["size"]
+            self.file = open(self.path, "ab")
+        else:
+            self.frames = []
+            self.offset = 0
+            self.file = open(self.path, "wb")
+        self.buffer = bytearray()
+
+    def write(self, data):
+        self.buffer += data
+        if len(self.buffer) >= FRAME_SIZE:
+            self._write_full_frames()
+        return len(data)
+
+    def tell(self):
+        return self.offset + len(self.buffer)
+
+    def _write_full_frames(self):
+        search_from = FRAME_SIZE
+        while len(self.buffer) >= FRAME_SIZE:
+            newline = self.buffer.find(b"\n", search_from - 1)
+            if newline == -1:
+                return
+            cut = newline + 1
+            if cut < len(self.buffer) and log_timestamps.get_timestamp_length(self.buffer[cut:cut + log_timestamps.TIMESTAMP_LENGTH_MILLISECONDS]):
+                self._write_frame(cut)
+                search_from = FRAME_SIZE
+            elif cut >= len(self.buffer):
+                # Need to see the next line to know if a log message starts there
+                return
+            else:
+                search_from = cut + 1
+
+    def _write_frame(self, length):
+        frame = bytes(self.buffer[:length])
+        timestamp = log_timestamps.parse_timestamp(frame[:log_timestamps.TIMESTAMP_LENGTH_MILLISECONDS])
+        self.frames.append([self.offset, self.file.tell(), timestamp.isoformat() if timestamp else None])
+        self.file.write(gzip.compress(frame, mtime=0))
+        self.offset += length
+        del self.buffer[:length]
+
+    def close(self):
+        if self.buffer:
+            self._write_frame(len(self.buffer))
+        self.file.close()
+        with open(get_frame_index_path(self.path), "w") as index_h:
+            json.dump({"size": self.offset, "frames": self.frames}, index_h)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+def compress_log_file(path):
+    ''' Replaces the plain log file with a compressed one. Returns the path of the compressed file. '''
+    path = pathlib.Path(path)
+    compressed_path = pathlib.Path(str(path) + COMPRESSED_SUFFIX)
+    with open(path, "rb", buffering=READ_BUFFER_SIZE) as log_h, CompressedLogWriter(compressed_path) as writer:
+        for block in iter(lambda: log_h.read(READ_BUFFER_SIZE), b""):
+            writer.write(block)
+    path.unlink()
+    return compressed_path
+
+
+class FramesReader(gzip.GzipFile):
+    ''' GzipFile reading the frames of an already open compressed log file, which it closes when closed. '''
+
+    def __init__(self, log_h):
+        super().__init__(fileobj=log_h, mode="rb")
+        self.log_h = log_h
+
+    def close(self):
+        try:
+            super().close()
+        finally:
+            self.log_h.close()
+
+
+def open_log(path, offset=0):
+    '''
+        Returns a binary file object reading the uncompressed content of the log file from the offset. For a
+        compressed file, decompression starts at the frame holding the offset.
+    '''
+    log_h = open(path, "rb", buffering=READ_BUFFER_SIZE)
+    if not is_compressed(path):
+        log_h.seek(offset)
+        return log_h
+    frames = read_frame_index(path)["frames"]
+    position = bisect.bisect_right([frame[0] for frame in frames], offset) - 1
+    if position < 0:
+        return FramesReader(log_h)
+    log_h.seek(frames[position][1])
+    reader = FramesReader(log_h)
+    # Positions of the reader are relative to the start of the frame
+    reader.seek(offset - frames[position][0])
+    return reader
+
+
+def get_frame_offsets(path):
+    ''' Returns [(uncompressed offset, first timestamp)] for the frames of a compressed log starting with a log message. '''
+    return [(frame[0], datetime.datetime.fromisoformat(frame[2])) for frame in read_frame_index(path)["frames"] if frame[2]]
+
+
+def find_frame_offset_for_timestamp(path, timestamp):
+    '''
+        Returns the uncompressed offset of the frame of the compressed log to start reading at to find the first log
+        message at or after the timestamp: the last frame starting before it.
+    '''
+    offset = 0
+    for (frame_offset, frame_timestamp) in get_frame_offsets(path):
+        if frame_timestamp >= timestamp:
+            break
+        offset = frame_offset
+    return offset
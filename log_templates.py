@@ -0,0 +1,128 @@
+import collections
+import re
+
+'''
+    Online mining of log message templates, in the manner of Drain (He et al., "Drain: An Online Log Parsing
+    Approach with Fixed Depth Tree", ICWS 2017), to summarize thousands of log messages as a few templates like
+        ERROR [ca.company.project1.dao.ApplicationDao] Could not get application <*> for user <*>
+    The variable parts of a message (numbers, hex values, UUIDs, ...) are masked as <*>, except the numbers of error
+    codes like ORA-00060, then the message is placed by walking a tree on its number of tokens and its first
+    PREFIX_DEPTH tokens, so only the few templates in that leaf are compared with it: the most similar one takes it,
+    replacing the tokens that differ by <*>, or else it starts a new template.
+    Memory is bounded: a tree node has at most MAX_CHILDREN children, and once there are max_templates templates
+    the least recently seen one is dropped.
+'''
+
+MASK = "<*>"
+# The number of an error code like ORA-00060: 3 to 5 digits after 2 to 5 upper case letters and a dash
+ERROR_CODE_NUMBER = r"(?:{0})\d{{3,5}}\b".format("|".join(r"(?<=\b[A-Z]{{{0}}}-)".format(count) for count in range(2, 6)))
+VARIABLE_PATTERN = re.compile(r"\b(?!" + ERROR_CODE_NUMBER + r")(?:[0-9a-fA-F]{8}-[0-9a-fA-F]{4}-[0-9a-fA-F]{4}-[0-9a-fA-F]{4}-[0-9a-fA-F]{12}"
+                              r"|0x[0-9a-fA-F]+|(?=[a-fA-F]*\d)[0-9a-fA-F]{8,}|\d+(?:[.:,]\d+)*)\b")
+PREFIX_DEPTH = 2
+MAX_CHILDREN = 100
+SIMILARITY_THRESHOLD = 0.4
+DEFAULT_MAX_TEMPLATES = 1000
+
+
+def get_tokens(text):
+    ''' Returns the tokens of the text, with their variable parts masked. '''
+    return VARIABLE_PATTERN.sub(MASK, text).split()
+
+
+class LogTemplate:
+    ''' A template, with the number of log messages it matched, when they were first and last seen and an example. '''
+    __slots__ = ("template_id", "tokens", "count", "first_seen", "last_seen", "example")
+
+    def __init__(self, template_id, tokens, count, first_seen, last_seen, example):
+        self.template_id = template_id
+        self.tokens = tokens
+        self.count = count
+        self.first_seen = first_seen
+        self.last_seen = last_seen
+        self.example = example
+
+    def text(self):
+        return " ".join(self.tokens)
+
+
+class TreeNode:
+    __slots__ = ("children", "template_ids")
+
+    def __init__(self):
+        self.children = {}
+        self.template_ids = []
+
+
+class TemplateMiner:
+
+    def __init__(self, max_templates=DEFAULT_MAX_TEMPLATES):
+        self.max_templates = max_templates
+        self.root = TreeNode()
+        # Least recently seen first
+        self.templates = collections.OrderedDict()
+        self.leaves = {}
+        self.next_id = 0
+        self.dropped_count = 0
+
+    def get_leaf(self, tokens):
+        node = self.root.children.setdefault(len(tokens), TreeNode())
+        for token in tokens[:PREFIX_DEPTH]:
+            key = MASK if MASK in token else token
+            if key not in node.children:
+                if len(node.children) >= MAX_CHILDREN - 1 and key != MASK:
+                    # Keep one child for the tokens that do not fit
+                    key = MASK
+                node = node.children.setdefault(key, TreeNode())
+            else:
+                node = node.children[key]
+        return node
+
+    def find_template(self, leaf, tokens):
+        ''' Returns the most similar template in the leaf, if it is similar enough. '''
+        best, best_similarity, best_masks = None, -1, -1
+        for template_id in leaf.template_ids:
+            template = self.templates[template_id]
+            same = sum(1 for (template_token, token) in zip(template.tokens, tokens) if template_token == token and template_token != MASK)
+            masks = template.tokens.count(MASK)
+            similarity = same / len(tokens) if tokens else 1.0
+            if similarity > best_similarity or (similarity == best_similarity and masks > best_masks):
+                best, best_similarity, best_masks = template, similarity, masks
+        return best if best and best_similarity >= SIMILARITY_THRESHOLD else None
+
+    def add_tokens(self, tokens, first_seen, last_seen, example, count=1):
+        ''' Adds count log messages with the tokens, or a template of another miner. Returns its template. '''
+        leaf = self.get_leaf(tokens)
+        template = self.find_template(leaf, tokens)
+        if template:
+            template.tokens = [template_token if template_token == token else MASK for (template_token, token) in zip(template.tokens, tokens)]
+            template.count += count
+            template.first_seen = min(template.first_seen, first_seen)
+            template.last_seen = max(template.last_seen, last_seen)
+            self.templates.move_to_end(template.template_id)
+            return template
+        template = LogTemplate(self.next_id, tokens, count, first_seen, last_seen, example)
+        self.next_id += 1
+        self.templates[template.template_id] = template
+        leaf.template_ids.append(template.template_id)
+        self.leaves[template.template_id] = leaf
+        if len(self.templates) > self.max_templates:
+            self.drop_least_recent()
+        return template
+
+    def add(self, text, timestamp, example=None):
+        ''' Adds a log message seen at timestamp. Returns its template. '''
+        return self.add_tokens(get_tokens(text), timestamp, timestamp, example or text)
+
+    def drop_least_recent(self):
+        template_id, template = self.templates.popitem(last=False)
+        self.leaves.pop(template_id).template_ids.remove(template_id)
+        self.dropped_count += template.count
+
+    def merge(self, templates):
+        ''' Adds the templates from another miner, in the form returned by get_templates. '''
+        for template in templates:
+            self.add_tokens(template.tokens, template.first_seen, template.last_seen, template.example, template.count)
+
+    def get_templates(self):
+        ''' Returns the templates, the ones matching the most log messages first. '''
+        return sorted(self.templates.values(), key=lambda template: (-template.count, template.first_seen))
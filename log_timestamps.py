@@ -0,0 +1,129 @@
+import argparse
+import datetime
+import logging
+import re
+import timeit
+
+import common_utils
+
+'''
+    Fast parsing of the timestamps at the start of log lines, in the fixed layout YYYY-MM-DD HH:MM:SS,mmm (the
+    seconds and milliseconds are optional). Used by logs, check_log_durations and check_files_for_changes instead of
+    regular expressions and datetime.strptime.
+    The fields are sliced at fixed offsets after checking the separators, so lines that are not timestamped (stack
+    trace lines, etc.) are rejected after a few character comparisons. The fields are checked to be digits before
+    int() is given them, as it also accepts spaces, signs and underscores. Consecutive log lines almost always share the
+    same date and hour, so the parsed YYYY-MM-DD HH prefix is cached.
+    Both str and bytes lines are accepted.
+'''
+
+DASHES = ("-", b"-")
+SPACES = (" ", b" ")
+COLONS = (":", b":")
+COMMAS = (",", b",", ".", b".")
+
+TIMESTAMP_LENGTH_MINUTES = len("2020-03-26 14:07")
+TIMESTAMP_LENGTH_SECONDS = len("2020-03-26 14:07:10")
+TIMESTAMP_LENGTH_MILLISECONDS = len("2020-03-26 14:07:10,296")
+
+_hour_cache = (None, None)
+
+
+def get_timestamp_length(line):
+    ''' Returns the length of the timestamp at the start of the line, or 0 if it does not start with one. '''
+    if (len(line) < TIMESTAMP_LENGTH_MINUTES or line[4:5] not in DASHES or line[7:8] not in DASHES
+            or line[10:11] not in SPACES or line[13:14] not in COLONS):
+        return 0
+    if line[16:17] not in COLONS:
+        return TIMESTAMP_LENGTH_MINUTES
+    if line[19:20] not in COMMAS:
+        return TIMESTAMP_LENGTH_SECONDS
+    return TIMESTAMP_LENGTH_MILLISECONDS
+
+
+def parse_timestamp(line):
+    ''' Returns the datetime at the start of the line, or None if the line does not start with a timestamp. '''
+    global _hour_cache
+    length = get_timestamp_length(line)
+    if not length:
+        return None
+    prefix = line[:13]
+    cached_prefix, hour_fields = _hour_cache
+    try:
+        if prefix != cached_prefix:
+            fields = (line[0:4], line[5:7], line[8:10], line[11:13])
+            if not all(field.isdigit() for field in fields):
+                return None
+            hour_fields = tuple(int(field) for field in fields)
+            _hour_cache = (prefix, hour_fields)
+        minutes = line[14:16]
+        seconds = line[17:19] if length > TIMESTAMP_LENGTH_MINUTES else "0"
+        milliseconds = line[20:23] if length == TIMESTAMP_LENGTH_MILLISECONDS else "0"
+        if not (minutes.isdigit() and seconds.isdigit() and milliseconds.isdigit()):
+            return None
+        return datetime.datetime(hour_fields[0], hour_fields[1], hour_fields[2], hour_fields[3], int(minutes), int(seconds), int(milliseconds) * 1000)
+    except ValueError:
+        return None
+
+
+def split_timestamp(line):
+    '''
+        Returns (timestamp, rest_of_line) where rest_of_line is what follows the timestamp, without the leading spaces
+        and the line ending. If the line does not start with a timestamp, returns (None, line).
+    '''
+    timestamp = parse_timestamp(line)
+    if not timestamp:
+        return None, line
+    return timestamp, line[get_timestamp_length(line):].lstrip().rstrip("\r\n")
+
+
+_BENCHMARK_REGEX = re.compile(r"^(?P<year>\d{4})-(?P<month>\d{2})-(?P<day>\d{2}) (?P<hours>\d{2}):(?P<minutes>\d{2})(:(?P<seconds>\d{2}))?(,(?P<milliseconds>[0-9]{3}))?\s*(?P<rest>.*)$")
+
+
+def _parse_with_regex(line):
+    ''' How logs.parse_line parsed timestamps before this module, kept for the benchmark. '''
+    parts = _BENCHMARK_REGEX.match(line)
+    if parts:
+        seconds = int(parts.groupdict()['seconds']) if parts.groupdict()['seconds'] else 0
+        return datetime.datetime(int(parts.groupdict()['year']), int(parts.groupdict()['month']), int(parts.groupdict()['day']),
+                                 int(parts.groupdict()['hours']), int(parts.groupdict()['minutes']), seconds)
+    return None
+
+
+def _parse_with_strptime(line):
+    ''' How check_log_durations parsed timestamps before this module, kept for the benchmark. '''
+    try:
+        return datetime.datetime.strptime(line[:TIMESTAMP_LENGTH_MILLISECONDS], "%Y-%m-%d %H:%M:%S,%f")
+    except ValueError:
+        return None
+
+
+def run_benchmark(line_count, continuation_ratio):
+    lines = []
+    timestamp = datetime.datetime(2020, 3, 26, 14, 0, 0)
+    for count in range(line_count):
+        if count % 100 < continuation_ratio * 100:
+            lines.append("\tat ca.company.project1.dao.ApplicationDao.getAuthorizedApplication(ApplicationDao.java:123)\n")
+        else:
+            timestamp += datetime.timedelta(milliseconds=250)
+            lines.append("{0:%Y-%m-%d %H:%M:%S},{1:03d} DEBUG [WebContainer : 3] [ca.company.project1.dao.ApplicationDao] - PL/SQL -- execute succeeds!\n".format(timestamp, timestamp.microsecond // 1000))
+    parsers = [("regex (old logs.parse_line)", _parse_with_regex),
+               ("strptime (old check_log_durations)", _parse_with_strptime),
+               ("log_timestamps.parse_timestamp", parse_timestamp)]
+    logging.info("{0} lines, {1:.0%} of them continuation lines".format(line_count, continuation_ratio))
+    for (name, parser) in parsers:
+        seconds = min(timeit.repeat(lambda: [parser(line) for line in lines], number=1, repeat=3))
+        logging.info("{0:40} {1:12,.0f} lines/sec".format(name, line_count / seconds))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Micro-benchmark of the log timestamp parsers.")
+    parser.add_argument("-l", "--lines", dest="line_count", type=int, default=200000, help="Number of log lines to parse.")
+    parser.add_argument("-c", "--continuation", dest="continuation_ratio", type=float, default=0.3,
+                        help="Fraction of the lines that are continuation lines without a timestamp.")
+    args = parser.parse_args()
+
+    log_file_path = common_utils.get_log_file_path("~/reports", "log_timestamps")
+    common_utils.setup_logger_to_console_file(log_file_path)
+
+    run_benchmark(args.line_count, args.continuation_ratio)
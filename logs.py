@@ -1,45 +1,101 @@
 import argparse
+import collections
+import concurrent.futures
 import datetime
+import heapq
+import itertools
+import json
 import logging
+import mmap
+import os
 import pathlib
 import re
+import tempfile
+import threading
+import urllib.parse
 
 import requests
+import requests.adapters
+from bs4 import BeautifulSoup
 
 import common_utils
 import environment
+import log_catalog
+import log_index
+import log_store
+import log_timestamps
 
-FILENAME_PATTERN = re.compile("(?P<app_nane>[a-zA-Z-]*)_(?P<server_name>[a-zA-Z0-9]*_)?(?P<start_year>\d{4})(?P<start_month>\d{2})(?P<start_day>\d{2})-(?P<start_hours>\d{2})(?P<start_minutes>\d{2})(?P<start_seconds>\d{2})\d*_(?P<end_year>\d{4})(?P<end_month>\d{2})(?P<end_day>\d{2})-(?P<end_hours>\d{2})(?P<end_minutes>\d{2})(?P<end_seconds>\d{2})\d*.log")
+FILENAME_PATTERN = re.compile("(?P<app_nane>[a-zA-Z0-9-]*)_(?P<server_name>[a-zA-Z0-9]*_)?(?P<start_year>\d{4})(?P<start_month>\d{2})(?P<start_day>\d{2})-(?P<start_hours>\d{2})(?P<start_minutes>\d{2})(?P<start_seconds>\d{2})\d*_(?P<end_year>\d{4})(?P<end_month>\d{2})(?P<end_day>\d{2})-(?P<end_hours>\d{2})(?P<end_minutes>\d{2})(?P<end_seconds>\d{2})\d*.log")
 
-def get_logs_from_local(env_name, app_name, timestamp, end_timestamp=None):
+def get_local_log_dir_mtime(env_name, app_name):
+    log_dir = pathlib.Path(environment.LOCAL_LOG_DIRECTORY, env_name, app_name)
+    return log_dir.stat().st_mtime_ns if log_dir.exists() else None
+
+
+def catalog_local_logs(env_name, app_name, rebuild=False):
     '''
-        Logs are stored in a local test_data with names in th eformat of <app_name>_[<server_name>_]<start-timestamp>_<end-timestamp>.log
-        Example: ID-FILING_wasdev5_20200229-19331583004828_20200311-05451583905506.log
+        Adds the log files in the local test_data for the app and environment that are not in the log catalog yet, or
+        all of them if rebuild, using the start and end timestamps in the file names. The seconds in the file names
+        are not reliable, so the start is taken as the beginning of its minute and the end as the end of its minute.
     '''
     log_dir = pathlib.Path(environment.LOCAL_LOG_DIRECTORY, env_name, app_name)
-
-    found_files = []
+    count = 0
     if log_dir.exists():
-        for log_path in log_dir.glob("*.log"):
-            # Parse out the start and end timestamps from the file names to see if the desired timestamp is present
+        # Taken before the scan, so the files added while it runs are found by the next one
+        mtime_ns = log_dir.stat().st_mtime_ns
+        known_paths = set() if rebuild else log_catalog.get_log_file_paths(env_name, app_name)
+        for log_path in itertools.chain(log_dir.glob("*.log"), log_dir.glob("*.log" + log_store.COMPRESSED_SUFFIX)):
+            if str(log_path) in known_paths:
+                continue
             parts = FILENAME_PATTERN.match(log_path.name)
             if parts:
-                start = datetime.datetime(int(parts.groupdict()['start_year']), int(parts.groupdict()['start_month']), int(parts.groupdict()['start_day']),
-                                              int(parts.groupdict()['start_hours']), int(parts.groupdict()['start_minutes']), int(parts.groupdict()['start_seconds']))
-                end = datetime.datetime(int(parts.groupdict()['end_year']), int(parts.groupdict()['end_month']), int(parts.groupdict()['end_day']),
-                                              int(parts.groupdict()['end_hours']), int(parts.groupdict()['end_minutes']), int(parts.groupdict()['end_seconds']))
-                if start <= timestamp and timestamp <= end:
-                    found_files.append(log_path)
-                    logging.debug("Log file {0} does contain timestamp {1}".format(log_path, timestamp))
-                elif end_timestamp and start <= end_timestamp and end_timestamp <= end:
-                    found_files.append(log_path)
-                    logging.debug("Log file {0} does contain end timestamp {1}".format(log_path, end_timestamp))
-                else:
-                    logging.debug("Log file name {0} does NOT contain timestamp {1}".format(log_path, timestamp))
+                gp = parts.groupdict()
+                start = datetime.datetime(int(gp['start_year']), int(gp['start_month']), int(gp['start_day']),
+                                          int(gp['start_hours']), int(gp['start_minutes']))
+                end = datetime.datetime(int(gp['end_year']), int(gp['end_month']), int(gp['end_day']),
+                                        int(gp['end_hours']), int(gp['end_minutes']), 59)
+                server = (gp['server_name'] or "").rstrip("_")
+                log_catalog.add_log_file(env_name, app_name, server, start, end, log_path)
+                count += 1
             else:
-                logging.debug("Log file name {0} does NOT contain timestamps".format(log_path, timestamp))
-    else:
-        logging.debug("There are not local copies of logs for the {0} app in the {1} environment.".format(app_name, env_name))
+                logging.debug("Log file name {0} does NOT contain timestamps".format(log_path))
+        log_catalog.set_scanned_mtime(env_name, app_name, mtime_ns)
+    logging.debug("Added {0} local copies of log files for the {1} app in the {2} environment to the catalog".format(count, app_name, env_name))
+    return count
+
+
+def compress_local_logs(env_name, app_name):
+    ''' Compresses the plain local copies of the log files for the app and environment. Returns how many were. '''
+    log_dir = pathlib.Path(environment.LOCAL_LOG_DIRECTORY, env_name, app_name)
+    remote_state = load_remote_state(log_dir)
+    count = 0
+    for log_path in log_dir.glob("*.log"):
+        if not FILENAME_PATTERN.match(log_path.name):
+            continue
+        compressed_path = log_store.compress_log_file(log_path)
+        log_catalog.remove_log_file(log_path)
+        log_index.delete_index(log_path)
+        for (url, entry) in remote_state.items():
+            if entry["path"] == str(log_path):
+                entry["path"] = str(compressed_path)
+                update_remote_state(log_dir, url, entry)
+        logging.debug("Compressed local log file {0} to {1}".format(log_path, compressed_path))
+        count += 1
+    catalog_local_logs(env_name, app_name)
+    return count
+
+
+def get_logs_from_local(env_name, app_name, timestamp, end_timestamp=None):
+    '''
+        Logs are stored in a local test_data with names in th eformat of <app_name>_[<server_name>_]<start-timestamp>_<end-timestamp>.log
+        Example: ID-FILING_wasdev5_20200229-19331583004828_20200311-05451583905506.log
+        They are looked up in the log catalog, to which the new files of the local test_data are added whenever the
+        directory changed since it was last scanned, so files copied there by hand are found too.
+        Returns the files that overlap the time period from timestamp to end_timestamp.
+    '''
+    if log_catalog.get_scanned_mtime(env_name, app_name) != get_local_log_dir_mtime(env_name, app_name):
+        catalog_local_logs(env_name, app_name)
+    found_files = [found["path"] for found in log_catalog.find_log_files(env_name, app_name, timestamp, end_timestamp)]
     logging.debug("Found {0} local copies of log files for the {1} app in the {2} environment that contain timestamp {3}".format(len(found_files), app_name, env_name, timestamp))
 
     return found_files
@@ -48,21 +104,88 @@ NOTE_FILE_LINE_PATTERN = re.compile("^(?P<year>\d{4})-(?P<month>\d{2})-(?P<day>\
 '''2020-03-26 14:07:10,296 DEBUG [ca.gc.ic.cipo.ec.job.scheduling.SchedulingManager] - Maximum retry count is 0'''
 
 def parse_line(line):
-    parts = NOTE_FILE_LINE_PATTERN.match(line)
-    if parts:
-        # logging.info(parts.groupdict())
-        hours = int(parts.groupdict()['hours'])
-        if parts.groupdict()['seconds']:
-            seconds = int(parts.groupdict()['seconds'])
+    ''' Returns (timestamp, rest_of_line) for a line in the NOTE_FILE_LINE_PATTERN format, or (None, line) '''
+    return log_timestamps.split_timestamp(line)
+
+
+TIMESTAMP_PREFIX_SIZE = 64
+
+
+def get_line_start(mm, position):
+    ''' Returns the offset of the start of the first line at or after position in the memory-mapped file. '''
+    if position <= 0:
+        return 0
+    newline = mm.find(b"\n", position - 1)
+    return len(mm) if newline == -1 else newline + 1
+
+
+def get_timestamped_line_at_or_after(mm, position):
+    '''
+        Returns (offset, timestamp) of the first line at or after position that starts with a timestamp, skipping the
+        continuation lines of multiline log messages. Returns (len(mm), None) if there is no such line.
+    '''
+    size = len(mm)
+    offset = get_line_start(mm, position)
+    while offset < size:
+        line_end = mm.find(b"\n", offset, offset + TIMESTAMP_PREFIX_SIZE)
+        timestamp, rest_of_line = parse_line(mm[offset:line_end if line_end != -1 else offset + TIMESTAMP_PREFIX_SIZE].decode("utf-8", "replace"))
+        if timestamp:
+            return offset, timestamp
+        offset = get_line_start(mm, offset + 1)
+    return size, None
+
+
+def find_offset_for_timestamp(mm, timestamp):
+    '''
+        Binary search on byte offsets of the memory-mapped log file for the first log message with a timestamp at or
+        after the timestamp, relying on the log messages being in time order. Returns len(mm) if there is none.
+    '''
+    low, high = 0, len(mm)
+    while low < high:
+        middle = (low + high) // 2
+        offset, line_timestamp = get_timestamped_line_at_or_after(mm, middle)
+        if line_timestamp and line_timestamp < timestamp:
+            # Every position up to this line leads to the same too early log message
+            low = offset + 1
         else:
-            seconds = 0
-        timestamp = datetime.datetime(int(parts.groupdict()['year']), int(parts.groupdict()['month']), int(parts.groupdict()['day']),
-                                      hours, int(parts.groupdict()['minutes']), seconds)
-        rest = parts.groupdict()['rest']
-    else:
-        timestamp = None
-        rest = line
-    return timestamp, rest
+            high = middle
+    return get_timestamped_line_at_or_after(mm, low)[0]
+
+
+def seek_to_timestamp(log_h, timestamp):
+    '''
+        Moves the position of the open log file to the first log message at or after the timestamp, so reading can
+        start there instead of at the beginning of the file. Returns the new position.
+    '''
+    if not timestamp or os.fstat(log_h.fileno()).st_size == 0:
+        return log_h.tell()
+    with mmap.mmap(log_h.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+        offset = find_offset_for_timestamp(mm, timestamp)
+    log_h.seek(offset)
+    return offset
+
+
+def get_last_timestamp(mm):
+    ''' Returns the timestamp of the last line starting with a timestamp in the memory-mapped file, or None. '''
+    line_end = len(mm)
+    while line_end > 0:
+        line_start = mm.rfind(b"\n", 0, line_end - 1) + 1
+        timestamp, rest_of_line = parse_line(mm[line_start:min(line_end, line_start + TIMESTAMP_PREFIX_SIZE)].decode("utf-8", "replace"))
+        if timestamp:
+            return timestamp
+        line_end = line_start
+    return None
+
+
+def get_first_and_last_timestamps(path):
+    ''' Returns (first timestamp, last timestamp) of a plain log file, reading only its head and tail. '''
+    with open(path, "rb") as log_h:
+        if os.fstat(log_h.fileno()).st_size == 0:
+            return None, None
+        with mmap.mmap(log_h.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            offset, first_timestamp = get_timestamped_line_at_or_after(mm, 0)
+            return first_timestamp, get_last_timestamp(mm)
+
 
 def get_unique_file_path(dir, prefix, extension):
     tmp_file = pathlib.Path(dir, "{}.{}".format(prefix, extension))
@@ -72,154 +195,834 @@ def get_unique_file_path(dir, prefix, extension):
         count += 1
     return tmp_file
 
-    
-def save_log_from_url_to_file(url, env_name, app_name, server_name, log_dir):
-    log_file_path = None
+
+DOWNLOAD_CHUNK_SIZE = 1024 * 1024
+DEFAULT_DOWNLOAD_WORKERS = 4
+HTML_PAGE_START = b'<!DOCTYPE HTML PUBLIC "-//IETF//DTD HTML 2.0//EN">'
+
+
+def write_chunks_and_find_timestamps(chunks, out_h):
+    '''
+        Writes the byte chunks to out_h while finding the first and last log timestamps in them, holding no more than
+        one chunk plus a partial line in memory. Returns (first_timestamp, last_timestamp, is_log_file), where
+        is_log_file is False when the content turns out to be an html error page instead of a log.
+    '''
+    first_timestamp = last_timestamp = None
+    partial_line = b""
+    for chunk in chunks:
+        if not chunk:
+            continue
+        out_h.write(chunk)
+        lines = (partial_line + chunk).split(b"\n")
+        partial_line = lines.pop()
+        if not first_timestamp:
+            for line in lines:
+                if line.rstrip() == HTML_PAGE_START:
+                    return None, None, False
+                first_timestamp, rest_of_line = parse_line(line.decode("utf-8", "replace"))
+                if first_timestamp:
+                    break
+        # Only the last line with a timestamp in each chunk matters for the last timestamp
+        for line in reversed(lines):
+            timestamp, rest_of_line = parse_line(line.decode("utf-8", "replace"))
+            if timestamp:
+                last_timestamp = timestamp
+                break
+    if partial_line:
+        timestamp, rest_of_line = parse_line(partial_line.decode("utf-8", "replace"))
+        if timestamp:
+            first_timestamp = first_timestamp or timestamp
+            last_timestamp = timestamp
+    return first_timestamp, last_timestamp, True
+
+
+def get_session(pool_size=DEFAULT_DOWNLOAD_WORKERS):
+    ''' Returns a requests Session that keeps up to pool_size keep-alive connections per log server open. '''
+    session = requests.Session()
+    adapter = requests.adapters.HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
+
+def get_log_file_path(log_dir, app_name, server_name, first_timestamp, last_timestamp, compressed=False):
+    # <app_name>_[<server_name>_]<start-timestamp>_<end-timestamp>.log[.gz]
+    return pathlib.Path(log_dir, "{0}_{1}_{2:%Y%m%d-%H%M%s}_{3:%Y%m%d-%H%M%s}.log{4}".format(app_name, server_name, first_timestamp, last_timestamp, log_store.COMPRESSED_SUFFIX if compressed else ""))
+
+
+REMOTE_STATE_FILE_NAME = "remote_state.json"
+VALIDATOR_CACHE_FILE_NAME = "validator_cache.json"
+SYNC_OVERLAP_SIZE = 4096
+_remote_state_lock = threading.Lock()
+
+
+def load_state_file(log_dir, file_name):
+    state_path = pathlib.Path(log_dir, file_name)
+    if not state_path.exists():
+        return {}
+    try:
+        with open(state_path, "r") as state_h:
+            return json.load(state_h)
+    except ValueError as ex:
+        logging.warning("Ignoring unreadable state file {0}. {1}".format(state_path, ex))
+        return {}
+
+
+def update_state_file(log_dir, file_name, key, entry):
+    state_path = pathlib.Path(log_dir, file_name)
+    with _remote_state_lock:
+        state = load_state_file(log_dir, file_name)
+        if entry:
+            state[key] = entry
+        else:
+            state.pop(key, None)
+        tmp_path = state_path.with_suffix(".tmp")
+        with open(tmp_path, "w") as state_h:
+            json.dump(state, state_h, indent=1)
+        tmp_path.replace(state_path)
+
+
+def load_remote_state(log_dir):
+    '''
+        Returns the dict, keyed by url, of what is known about each remote log file already downloaded to log_dir:
+        {"path": <local copy>, "offset": <bytes downloaded>, "etag": ..., "last_modified": ..., "first_timestamp": ..., "last_timestamp": ...}
+        Rotated log files also have "immutable": True and the "rotation_marker" they were last checked with.
+    '''
+    return load_state_file(log_dir, REMOTE_STATE_FILE_NAME)
+
+
+def update_remote_state(log_dir, url, entry):
+    ''' Saves the entry for the url in the remote state file of log_dir, or removes it if entry is None. '''
+    update_state_file(log_dir, REMOTE_STATE_FILE_NAME, url, entry)
+
+
+def load_validator_cache(log_dir):
+    '''
+        Returns the dict, keyed by get_validator_key, of the rotated log files already downloaded to log_dir. Rotated
+        files never change, they are only renamed from <log>.001 to <log>.002 and so on at each rotation, so a file
+        seen under one url is found again here under the next one.
+    '''
+    return load_state_file(log_dir, VALIDATOR_CACHE_FILE_NAME)
+
+
+def update_validator_cache(log_dir, key, entry):
+    update_state_file(log_dir, VALIDATOR_CACHE_FILE_NAME, key, entry)
+
+
+def get_validator_key(etag, last_modified, content_length):
+    ''' Returns a key identifying the content of a remote file from its validators, or None. '''
+    if etag:
+        return "etag {0}".format(etag)
+    if last_modified and content_length:
+        return "modified {0} length {1}".format(last_modified, content_length)
+    return None
+
+
+def find_downloaded_log(log_dir, validator_key):
+    '''
+        Returns the remote state entry of a complete local copy of the remote file with the validator key, looking
+        first at the rotated files and then at the current log files, which become <log>.001 when rotated.
+    '''
+    cached = load_validator_cache(log_dir).get(validator_key)
+    if cached and pathlib.Path(cached["path"]).exists():
+        return cached
+    for entry in load_remote_state(log_dir).values():
+        if (get_validator_key(entry.get("etag"), entry.get("last_modified"), entry.get("offset")) == validator_key
+                and pathlib.Path(entry["path"]).exists() and log_store.get_log_size(entry["path"]) == entry["offset"]):
+            return entry
+    return None
+
+
+def get_conditional_headers(entry):
+    headers = {'User-Agent': 'Mozilla/5.0'}
+    if entry and entry.get("etag"):
+        headers["If-None-Match"] = entry["etag"]
+    elif entry and entry.get("last_modified"):
+        headers["If-Modified-Since"] = entry["last_modified"]
+    return headers
+
+
+def get_remote_state_entry(response, log_file_path, offset, first_timestamp, last_timestamp):
+    return {"path": str(log_file_path),
+            "offset": offset,
+            "etag": response.headers.get("ETag"),
+            "last_modified": response.headers.get("Last-Modified"),
+            "first_timestamp": first_timestamp.isoformat(),
+            "last_timestamp": last_timestamp.isoformat()}
+
+
+def save_log_from_url_to_file(url, env_name, app_name, server_name, log_dir, session=None):
     # Headers to mimic a browser visit
     headers = {'User-Agent': 'Mozilla/5.0'}
 
-    # Returns a requests.models.Response object
+    # Returns a requests.models.Response object. Streamed so the log is never held in memory in full
     try:
-        myfile = requests.get(url, headers=headers)
+        myfile = (session or requests).get(url, headers=headers, stream=True)
     except Exception as ex:
-        logging.debug("Could not get url {0}. Exception {1}".format(url, ex.getMessage()))
+        logging.debug("Could not get url {0}. Exception {1}".format(url, ex))
         return None, None, None
 
     if myfile.status_code != 200:
         logging.debug("Attempting to get url {0} returned with a status code of {1}".format(url, myfile.status_code))
+        myfile.close()
         return None, None, None
-        
-    tmp_file = get_unique_file_path(log_dir, "temp_file", "log")    
-    open(tmp_file, 'wb').write(myfile.content)
-    
-    first_timestamp = last_timestamp = timestamp = None
-    proper_log_file_name = tmp_file
-    with open(tmp_file, "r") as log_h:
-        for line in log_h.readlines():
-            timestamp, rest_of_line = parse_line(line)
-            
-            if timestamp:
-                if (not first_timestamp or timestamp < first_timestamp):
-                    first_timestamp = timestamp
-                elif (not last_timestamp or timestamp > last_timestamp):
-                    last_timestamp = timestamp
-            elif not first_timestamp:
-                if line == '<!DOCTYPE HTML PUBLIC "-//IETF//DTD HTML 2.0//EN">':
-                    proper_log_file_name = None
-                    break
-                    
+    return save_response_to_file(myfile, url, env_name, app_name, server_name, log_dir)
+
+
+def save_response_to_file(myfile, url, env_name, app_name, server_name, log_dir, extra_state=None):
+    '''
+        Streams the body of the successful response for the log at the url to a local file named after its first and
+        last timestamps. Returns (path, first_timestamp, last_timestamp). extra_state is added to its remote state entry.
+    '''
+    # A unique temp file per download, as several downloads can be writing to the same directory at once
+    compressed = environment.COMPRESS_LOCAL_LOGS
+    tmp_fd, tmp_name = tempfile.mkstemp(prefix="temp_file_", suffix=".log" + (log_store.COMPRESSED_SUFFIX if compressed else ""), dir=log_dir)
+    tmp_file = pathlib.Path(tmp_name)
+    if compressed:
+        os.close(tmp_fd)
+        tmp_h = log_store.CompressedLogWriter(tmp_file)
+    else:
+        tmp_h = open(tmp_fd, 'wb')
+    with myfile, tmp_h:
+        first_timestamp, last_timestamp, is_log_file = write_chunks_and_find_timestamps(
+            myfile.iter_content(chunk_size=DOWNLOAD_CHUNK_SIZE), tmp_h)
+        downloaded_size = tmp_h.tell()
+    proper_log_file_name = tmp_file if is_log_file else None
+
     if first_timestamp and last_timestamp:
-        # <app_name>_[<server_name>_]<start-timestamp>_<end-timestamp>.log
-        proper_log_file_name = pathlib.Path(log_dir, "{0}_{1}_{2:%Y%m%d-%H%M%s}_{3:%Y%m%d-%H%M%s}.log".format(app_name, server_name, first_timestamp, last_timestamp))
+        proper_log_file_name = get_log_file_path(log_dir, app_name, server_name, first_timestamp, last_timestamp, compressed)
         if proper_log_file_name.exists():
             logging.debug("Deleting temp file {0} from url {1} as there is already a file with the name {2}.".format(tmp_file, url, proper_log_file_name))
-            tmp_file.unlink()
+            log_store.delete_log(tmp_file)
         else:
             logging.debug("Renaming temp download file {0} to proper filename {1}".format(tmp_file, proper_log_file_name))
-            tmp_file.rename(proper_log_file_name)
+            log_store.rename_log(tmp_file, proper_log_file_name)
+        log_catalog.add_log_file(env_name, app_name, server_name, first_timestamp, last_timestamp, proper_log_file_name)
+        entry = get_remote_state_entry(myfile, proper_log_file_name, downloaded_size, first_timestamp, last_timestamp)
+        entry.update(extra_state or {})
+        update_remote_state(log_dir, url, entry)
+        return proper_log_file_name, first_timestamp, last_timestamp
     elif not proper_log_file_name:
         logging.debug("Deleting temp file {0} as it does not appear to be a log file. Could not find url {1} ".format(tmp_file, url))
-        tmp_file.unlink()
+        log_store.delete_log(tmp_file)
     logging.debug("Did not get first_timestamp {0} and last_timestamp {1} from file at url {2} so could not rename the file from {3}".format(first_timestamp, last_timestamp, url, tmp_file))
     return proper_log_file_name, first_timestamp, last_timestamp
 
 
-def copy_logs_from_remote_to_local(env_name, app_name, timestamp, end_timestamp=None):
-    log_dir = pathlib.Path(environment.LOCAL_LOG_DIRECTORY, env_name, app_name)
-    if not log_dir.exists():
-        logging.debug("Creating log test_data {0}".format(log_dir))
-        log_dir.mkdir(parents=True, exist_ok=True)
+def sync_log_from_url_to_file(url, env_name, app_name, server_name, log_dir, session=None):
+    '''
+        Brings the local copy of the log at the url up to date by only requesting the bytes added since it was last
+        downloaded, using a Range request. The request starts SYNC_OVERLAP_SIZE bytes before the end of the local
+        copy and those bytes are compared to the local copy, so if the remote file was rotated (it got shorter or
+        its content changed) the whole file is fetched again with save_log_from_url_to_file instead.
+        Returns the same (path, first_timestamp, last_timestamp) as save_log_from_url_to_file.
+    '''
+    state = load_remote_state(log_dir).get(url)
+    local_path = pathlib.Path(state["path"]) if state else None
+    if not local_path or not local_path.exists() or log_store.get_log_size(local_path) != state["offset"]:
+        logging.debug("No usable local copy of url {0}, so getting the whole file.".format(url))
+        return save_log_from_url_to_file(url, env_name, app_name, server_name, log_dir, session)
+
+    offset = state["offset"]
+    first_timestamp = datetime.datetime.fromisoformat(state["first_timestamp"])
+    last_timestamp = datetime.datetime.fromisoformat(state["last_timestamp"])
+    overlap = min(SYNC_OVERLAP_SIZE, offset)
+    headers = get_conditional_headers(state)
+    headers['Range'] = "bytes={0}-".format(offset - overlap)
+    try:
+        myfile = (session or requests).get(url, headers=headers, stream=True)
+    except Exception as ex:
+        logging.debug("Could not get url {0}. Exception {1}".format(url, ex))
+        return None, None, None
+
+    with myfile:
+        if myfile.status_code == 304:
+            logging.debug("Local copy {0} of url {1} is already up to date.".format(local_path, url))
+            return local_path, first_timestamp, last_timestamp
+        if myfile.status_code == 416:
+            # Range not satisfiable, so the remote file is now shorter than the local copy
+            logging.debug("Url {0} is shorter than the local copy {1}, so it has been rotated.".format(url, local_path))
+            return save_log_from_url_to_file(url, env_name, app_name, server_name, log_dir, session)
+        if myfile.status_code == 200:
+            # The server ignored the Range header and is sending the whole file
+            logging.debug("Url {0} returned the whole file instead of a partial response.".format(url))
+            return save_response_to_file(myfile, url, env_name, app_name, server_name, log_dir)
+        if myfile.status_code != 206:
+            logging.debug("Url {0} returned status code {1} instead of a partial response, so getting the whole file.".format(url, myfile.status_code))
+            return save_log_from_url_to_file(url, env_name, app_name, server_name, log_dir, session)
+
+        chunks = myfile.iter_content(chunk_size=DOWNLOAD_CHUNK_SIZE)
+        remote_overlap = b""
+        for chunk in chunks:
+            remote_overlap += chunk
+            if len(remote_overlap) >= overlap:
+                break
+        with log_store.open_log(local_path, offset - overlap) as local_h:
+            local_overlap = local_h.read(overlap)
+        if remote_overlap[:overlap] != local_overlap:
+            logging.debug("The end of local copy {0} does not match url {1} anymore, so it has been rotated.".format(local_path, url))
+            return save_log_from_url_to_file(url, env_name, app_name, server_name, log_dir, session)
+
+        index = log_index.load_index(local_path)
+        if log_store.is_compressed(local_path):
+            local_h = log_store.CompressedLogWriter(local_path, append=True)
+        else:
+            local_h = open(local_path, "ab")
+        with local_h:
+            new_first_timestamp, new_last_timestamp, is_log_file = write_chunks_and_find_timestamps(
+                itertools.chain([remote_overlap[overlap:]], chunks), local_h)
+            new_offset = local_h.tell()
+        logging.debug("Appended {0} new bytes from url {1} to {2}".format(new_offset - offset, url, local_path))
+
+    last_timestamp = new_last_timestamp or last_timestamp
+    log_file_path = get_log_file_path(log_dir, app_name, server_name, first_timestamp, last_timestamp, log_store.is_compressed(local_path))
+    if log_file_path != local_path:
+        log_store.rename_log(local_path, log_file_path)
+        log_catalog.remove_log_file(local_path)
+        log_index.delete_index(local_path)
+    if index:
+        extend_index(log_file_path, index, offset)
+    log_catalog.add_log_file(env_name, app_name, server_name, first_timestamp, last_timestamp, log_file_path)
+    update_remote_state(log_dir, url, get_remote_state_entry(myfile, log_file_path, new_offset, first_timestamp, last_timestamp))
+    return log_file_path, first_timestamp, last_timestamp
+
+
+def get_rotated_log_from_url(url, env_name, app_name, server_name, log_dir, session=None, rotation_marker=None):
+    '''
+        Gets a rotated log file (<log>.001, <log>.002, ...), reusing local copies as much as possible:
+        - If it was already checked since the last rotation (the rotation_marker, the first timestamp of the current
+          log file, has not changed), the local copy is used without any request to the log server.
+        - Otherwise a conditional GET is sent, and on a 304 the local copy is used.
+        - If the response is for a file already downloaded under another url, as rotation renames the files, that
+          local copy is used and the body is not downloaded.
+        Returns the same (path, first_timestamp, last_timestamp) as save_log_from_url_to_file.
+    '''
+    entry = load_remote_state(log_dir).get(url)
+    if entry and not pathlib.Path(entry["path"]).exists():
+        entry = None
+    if entry and entry.get("immutable") and rotation_marker and entry.get("rotation_marker") == rotation_marker:
+        logging.debug("Using local copy {0} of url {1} as there has been no rotation since it was checked.".format(entry["path"], url))
+        return pathlib.Path(entry["path"]), datetime.datetime.fromisoformat(entry["first_timestamp"]), datetime.datetime.fromisoformat(entry["last_timestamp"])
+
+    try:
+        myfile = (session or requests).get(url, headers=get_conditional_headers(entry), stream=True)
+    except Exception as ex:
+        logging.debug("Could not get url {0}. Exception {1}".format(url, ex))
+        return None, None, None
+
+    cached = validator_key = None
+    if myfile.status_code == 304 and entry:
+        cached = entry
+        logging.debug("Url {0} has not changed, so using local copy {1}".format(url, entry["path"]))
+    elif myfile.status_code == 200:
+        validator_key = get_validator_key(myfile.headers.get("ETag"), myfile.headers.get("Last-Modified"), myfile.headers.get("Content-Length"))
+        cached = find_downloaded_log(log_dir, validator_key) if validator_key else None
+        if cached:
+            logging.debug("Url {0} is the already downloaded {1}, so not downloading it again.".format(url, cached["path"]))
+    else:
+        logging.debug("Attempting to get url {0} returned with a status code of {1}".format(url, myfile.status_code))
+        myfile.close()
+        return None, None, None
+
+    if cached:
+        myfile.close()
+        entry = dict(cached, immutable=True, rotation_marker=rotation_marker)
+        update_remote_state(log_dir, url, entry)
+        if validator_key:
+            update_validator_cache(log_dir, validator_key, entry)
+        return pathlib.Path(entry["path"]), datetime.datetime.fromisoformat(entry["first_timestamp"]), datetime.datetime.fromisoformat(entry["last_timestamp"])
+
+    log_file_path, first_timestamp, last_timestamp = save_response_to_file(myfile, url, env_name, app_name, server_name, log_dir,
+                                                                           {"immutable": True, "rotation_marker": rotation_marker})
+    if log_file_path and first_timestamp and validator_key:
+        update_validator_cache(log_dir, validator_key, load_remote_state(log_dir).get(url))
+    return log_file_path, first_timestamp, last_timestamp
+
+
+def get_log_url(env_name, app_name, server_name, file_count=0):
+    url = "{0}{1}{2}".format(environment.LOG_LOCATIONS[env_name]["root"], server_name, environment.LOG_APP_PATHS[app_name].format(prefix=environment.LOG_LOCATIONS[env_name]["prefix"]))
+    if file_count:
+        url = "{0}.{1:03d}".format(url, file_count)
+    return url
+
+
+LISTING_ENTRY_PATTERN = re.compile(r"(?P<modified>\d{4}-\d{2}-\d{2} \d{2}:\d{2}(:\d{2})?|\d{2}-[A-Za-z]{3}-\d{4} \d{2}:\d{2}(:\d{2})?)\s+(?P<size>\d+(\.\d+)?[KMGT]?|-)")
+'''Apache: "2020-03-24 16:40  1.2M" or "24-Mar-2020 16:40  1.2M", nginx: "24-Mar-2020 16:40  1234567"'''
+LISTING_DATE_FORMATS = ["%Y-%m-%d %H:%M", "%Y-%m-%d %H:%M:%S", "%d-%b-%Y %H:%M", "%d-%b-%Y %H:%M:%S"]
+LISTING_SIZE_UNITS = {"K": 1024, "M": 1024 ** 2, "G": 1024 ** 3, "T": 1024 ** 4}
+# Allowance for the minute precision of the listing and for the delay between the last write and the rotation
+LISTING_TIME_MARGIN = datetime.timedelta(minutes=10)
+
+
+def parse_listing_date(date_str):
+    for date_format in LISTING_DATE_FORMATS:
+        try:
+            return datetime.datetime.strptime(date_str, date_format)
+        except ValueError:
+            pass
+    return None
+
+
+def parse_listing_size(size_str):
+    ''' Returns the size in bytes of a listing size like 1234, 12K or 1.2M (approximate), or None for "-". '''
+    if size_str == "-":
+        return None
+    if size_str[-1] in LISTING_SIZE_UNITS:
+        return int(float(size_str[:-1]) * LISTING_SIZE_UNITS[size_str[-1]])
+    return int(size_str)
+
+
+def parse_listing_page(page_source, listing_url):
+    '''
+        Returns {url: {"modified": datetime, "size": bytes}} for the files of an autoindex directory listing page, in
+        either its table format (a row per file) or its preformatted format (a line per file after the link).
+    '''
+    listing = {}
+    soup = BeautifulSoup(page_source, features="lxml")
+    for anch in soup.find_all("a", href=True):
+        row = anch.find_parent("tr")
+        if row:
+            cols = row.find_all("td")
+            link_col = anch.find_parent("td")
+            details = " ".join(col.get_text(" ").strip() for col in cols[cols.index(link_col) + 1:]) if link_col in cols else ""
+        else:
+            details = anch.next_sibling if isinstance(anch.next_sibling, str) else ""
+        parts = LISTING_ENTRY_PATTERN.search(details)
+        modified = parse_listing_date(parts.group("modified")) if parts else None
+        if modified:
+            url = urllib.parse.urljoin(listing_url, anch.attrs["href"])
+            listing[url] = {"modified": modified, "size": parse_listing_size(parts.group("size"))}
+    return listing
+
+
+def get_remote_log_listing(env_name, app_name, server_name, session=None):
+    '''
+        Gets the directory listing of the log files of a server with a single request. Returns a list of
+        {"url", "file_count", "modified", "size"} for the current log file (file_count 0) and its rotated files
+        (<log>.001, <log>.002, ...), ordered by file_count, or None if there is no usable listing.
+    '''
+    current_url = get_log_url(env_name, app_name, server_name)
+    listing_url = current_url.rsplit("/", 1)[0] + "/"
+    try:
+        response = (session or requests).get(listing_url, headers={'User-Agent': 'Mozilla/5.0'})
+    except Exception as ex:
+        logging.debug("Could not get log listing {0}. Exception {1}".format(listing_url, ex))
+        return None
+    if response.status_code != 200:
+        logging.debug("Attempting to get log listing {0} returned with a status code of {1}".format(listing_url, response.status_code))
+        return None
+    rotated_pattern = re.compile(re.escape(current_url) + r"(\.(?P<file_count>\d{3}))?$")
+    log_files = []
+    for (url, details) in parse_listing_page(response.text, listing_url).items():
+        parts = rotated_pattern.match(url)
+        if parts:
+            file_count = int(parts.group("file_count")) if parts.group("file_count") else 0
+            log_files.append(dict(details, url=url, file_count=file_count))
+    log_files.sort(key=lambda log_file: log_file["file_count"])
+    if not log_files or log_files[0]["file_count"] != 0:
+        logging.debug("Log listing {0} does not list the log file {1}".format(listing_url, current_url))
+        return None
+    logging.debug("Log listing {0} has {1} log files".format(listing_url, len(log_files)))
+    return log_files
+
+
+def select_listed_logs(log_files, timestamp, end_timestamp=None):
+    '''
+        Returns the files of a listing from get_remote_log_listing whose time span can overlap timestamp to
+        end_timestamp, oldest first. A file is last written at its modified time, and starts about when the next
+        older file was last written, when it was rotated.
+    '''
+    end_timestamp = end_timestamp or timestamp
+    selected = []
+    for (position, log_file) in enumerate(log_files):
+        older_file = log_files[position + 1] if position + 1 < len(log_files) else None
+        # The current log file is still being written to
+        ends_after_start = log_file["file_count"] == 0 or log_file["modified"] + LISTING_TIME_MARGIN >= timestamp
+        starts_before_end = not older_file or older_file["modified"] - LISTING_TIME_MARGIN <= end_timestamp
+        if ends_after_start and starts_before_end:
+            selected.append(log_file)
+    return list(reversed(selected))
+
+
+def copy_listed_log_from_remote_to_local(env_name, app_name, server_name, log_dir, log_file, rotation_marker, session=None, incremental=None):
+    ''' Gets one log file from a listing of get_remote_log_listing. Returns its local path, or None. '''
+    if log_file["file_count"] == 0:
+        get_current_log = sync_log_from_url_to_file if incremental else save_log_from_url_to_file
+        log_file_path, first_timestamp, last_timestamp = get_current_log(log_file["url"], env_name, app_name, server_name, log_dir, session)
+    else:
+        log_file_path, first_timestamp, last_timestamp = get_rotated_log_from_url(log_file["url"], env_name, app_name, server_name, log_dir, session, rotation_marker)
+    return log_file_path
+
+
+def copy_server_logs_from_remote_to_local(env_name, app_name, server_name, log_dir, timestamp, session=None, incremental=None):
+    '''
+        Walks back through the current log file and its rotated files (<log>.001, <log>.002, ...) of one server until
+        finding the one containing the timestamp. Returns the local path of that file, or None if it was not found.
+        If incremental, only the bytes added to the current log file since it was last downloaded are fetched.
+    '''
+    file_count = 0
+    url = get_log_url(env_name, app_name, server_name, file_count)
+    logging.debug("Going to check url: {0}".format(url))
+    get_current_log = sync_log_from_url_to_file if incremental else save_log_from_url_to_file
+    log_file_path, first_timestamp, last_timestamp = get_current_log(url, env_name, app_name, server_name, log_dir, session)
+    # The current log file starts at a new time after every rotation
+    rotation_marker = first_timestamp.isoformat() if first_timestamp else None
+    while first_timestamp and last_timestamp and not (first_timestamp <= timestamp and timestamp <= last_timestamp):
+        file_count += 1
+        url = get_log_url(env_name, app_name, server_name, file_count)
+        logging.debug("Going to check url: {0}".format(url))
+        log_file_path, first_timestamp, last_timestamp = get_rotated_log_from_url(url, env_name, app_name, server_name, log_dir, session, rotation_marker)
+
+    if log_file_path:
+        logging.debug("Found log file containing timestamp {0} for application {1}, in environment {2}, in file {3}.".format(timestamp, app_name, env_name, log_file_path))
+    else:
+        logging.debug("Could not find valid log file at the url {}.".format(url))
+    return log_file_path
+
+
+def get_local_app_log_paths(env_name, app_name):
+    '''
+        Returns the paths of the log files of the app under the root of a local environment (like localhost), one for
+        each of its servers and log paths, or for each log path if it has no servers.
+    '''
+    location = environment.LOG_LOCATIONS[env_name]
+    app_paths = environment.LOG_APP_PATHS[app_name]
+    if isinstance(app_paths, str):
+        app_paths = [app_paths]
+    return [pathlib.Path("{0}{1}{2}".format(location["root"], server_name, app_path.format(prefix=location["prefix"])))
+            for server_name in location["servers"] or [""] for app_path in app_paths]
+
+
+def get_logs_in_place(env_name, app_name, timestamp, end_timestamp=None):
+    '''
+        Returns the log files of the app in a local environment, and their rotated files (<log>.1, <log>.001, ...),
+        that overlap the time period from timestamp to end_timestamp. They are used where they are instead of being
+        copied to LOCAL_LOG_DIRECTORY, and only their first and last lines are read to get their time span.
+    '''
+    end_timestamp = end_timestamp or timestamp
+    found_files = []
+    for app_log_path in get_local_app_log_paths(env_name, app_name):
+        rotated_pattern = re.compile(re.escape(app_log_path.name) + r"(\.\d+)?$")
+        log_paths = [log_path for log_path in app_log_path.parent.glob(app_log_path.name + "*") if rotated_pattern.match(log_path.name)] if app_log_path.parent.exists() else []
+        for log_path in sorted(log_paths, key=lambda log_path: log_path.stat().st_mtime):
+            first_timestamp, last_timestamp = get_first_and_last_timestamps(log_path)
+            if first_timestamp and last_timestamp and first_timestamp <= end_timestamp and timestamp <= last_timestamp:
+                found_files.append(log_path)
+    logging.debug("Found {0} log files for the {1} app in the {2} environment that overlap {3} to {4}".format(len(found_files), app_name, env_name, timestamp, end_timestamp))
+    return found_files
+
+
+def copy_logs_from_remote_to_local(env_name, app_name, timestamp, end_timestamp=None, workers=None, incremental=None):
     found_files = []
-    if env_name == "localhost": 
-        raise Exception("Need to handle looking for logs for localhost!")
+    if env_name == "localhost":
+        # Local logs are read where they are, so there is nothing to copy to LOCAL_LOG_DIRECTORY
+        found_files = get_logs_in_place(env_name, app_name, timestamp, end_timestamp)
     else:
-        for server_name in environment.LOG_LOCATIONS[env_name]["servers"]:
-            url = "{0}{1}{2}".format(environment.LOG_LOCATIONS[env_name]["root"], server_name, environment.LOG_APP_PATHS[app_name].format(prefix=environment.LOG_LOCATIONS[env_name]["prefix"]))
-            logging.debug("Going to check url: {0}".format(url))
-            log_file_path, first_timestamp, last_timestamp = save_log_from_url_to_file(url, env_name, app_name, server_name, log_dir)
-            file_count = 0
-            while first_timestamp and last_timestamp and not (first_timestamp <= timestamp and timestamp <= last_timestamp) :
-                file_count += 1
-                url = "{0}{1}{2}.{3:03d}".format(environment.LOG_LOCATIONS[env_name]["root"], server_name, environment.LOG_APP_PATHS[app_name].format(prefix=environment.LOG_LOCATIONS[env_name]["prefix"]), file_count)
-                logging.debug("Going to check url: {0}".format(url))
-                log_file_path, first_timestamp, last_timestamp = save_log_from_url_to_file(url, env_name, app_name, server_name, log_dir)
+        log_dir = pathlib.Path(environment.LOCAL_LOG_DIRECTORY, env_name, app_name)
+        if not log_dir.exists():
+            logging.debug("Creating log test_data {0}".format(log_dir))
+            log_dir.mkdir(parents=True, exist_ok=True)
+        # Every server is fetched at the same time, sharing a pool of keep-alive connections. The directory listing of
+        # each server tells which of its files can overlap the time period, and those are all downloaded at the same
+        # time. Without a listing, the rotated files of a server are walked in order as the timestamps of one file
+        # decide whether the next one is needed.
+        servers = environment.LOG_LOCATIONS[env_name]["servers"]
+        workers = workers or DEFAULT_DOWNLOAD_WORKERS
+        with get_session(workers) as session, concurrent.futures.ThreadPoolExecutor(max_workers=workers) as executor:
+            listings = list(executor.map(lambda server_name: get_remote_log_listing(env_name, app_name, server_name, session), servers))
+            server_futures = []
+            for (server_name, log_files) in zip(servers, listings):
+                if log_files is None:
+                    server_futures.append([executor.submit(copy_server_logs_from_remote_to_local, env_name, app_name, server_name, log_dir, timestamp, session, incremental)])
+                    continue
+                # The modified time of <log>.001 changes at every rotation
+                rotation_marker = "listing {0}".format(log_files[1]["modified"].isoformat()) if len(log_files) > 1 else None
+                server_futures.append([executor.submit(copy_listed_log_from_remote_to_local, env_name, app_name, server_name, log_dir, log_file, rotation_marker, session, incremental)
+                                       for log_file in select_listed_logs(log_files, timestamp, end_timestamp)])
+            # Results are collected in the order of the servers in environment.LOG_LOCATIONS, not completion order
+            found_files = [log_file_path for futures in server_futures for log_file_path in [future.result() for future in futures] if log_file_path]
 
-            else:
-                if log_file_path:
-                    logging.debug("Found log file containing timestamp {0} for application {1}, in environment {2}, in file {3}.".format(timestamp, app_name, env_name, log_file_path))
-                    found_files.append(log_file_path)
-                logging.debug("Could not find valid log file at the url {}.".format(url))
-                    
     return found_files
 
-    
-def get_log_msg(log_h, current_line=None):
+
+RECORD_READ_BUFFER_SIZE = 1024 * 1024
+
+
+class LogRecord:
+    ''' One log message: its timestamp, level, logger, the offset of its first line in the file and its full text. '''
+    __slots__ = ("timestamp", "level", "logger", "offset", "text")
+
+    def __init__(self, timestamp, level, logger, offset, text):
+        self.timestamp = timestamp
+        self.level = level
+        self.logger = logger
+        self.offset = offset
+        self.text = text
+
+    def lines(self):
+        return self.text.splitlines()
+
+
+def parse_record_header(first_line):
+    '''
+        Returns (level, logger) from the first line of a log message, in the format of
+        2020-03-26 14:07:10,296 DEBUG [WebContainer : 3] [ca.gc.ic.cipo.ec.job.scheduling.SchedulingManager] - Maximum retry count is 0
+    '''
+    rest_of_line = first_line[log_timestamps.get_timestamp_length(first_line):].lstrip()
+    level, separator, rest_of_line = rest_of_line.partition(" ")
+    header = rest_of_line.split(" - ", 1)[0]
+    logger_start = header.rfind("[")
+    logger_end = header.find("]", logger_start)
+    logger = header[logger_start + 1:logger_end] if logger_start != -1 and logger_end != -1 else None
+    return level.rstrip(), logger
+
+
+def make_log_record(timestamp, offset, text_parts):
+    text = b"".join(text_parts).decode("utf-8", "replace")
+    level, logger = parse_record_header(text.partition("\n")[0])
+    return LogRecord(timestamp, level, logger, offset, text)
+
+
+def read_records(log_h, offset=0, start=None, end=None, end_offset=None):
+    '''
+        Yields a LogRecord for each log message read from the binary file handle, which is positioned at offset.
+        Lines without a timestamp are continuation lines of the previous message; any before the first message are
+        skipped. Stops at the first message after end, or the first message starting at or after end_offset.
+    '''
     timestamp = None
-    log_msg_lines = []
-    if not current_line:
-        current_line = log_h.readline()
-    timestamp, rest_of_line = parse_line(current_line)
-    next_timestamp = None
-    log_msg_lines.append(current_line)
-    while not next_timestamp and current_line: 
-        current_line = log_h.readline()
-        next_timestamp, rest_of_line = parse_line(current_line)
-        if not next_timestamp:
-            log_msg_lines.append(current_line)
-    
-    return timestamp, log_msg_lines, current_line
+    record_offset = offset
+    text_parts = []
+    for line in log_h:
+        line_timestamp = log_timestamps.parse_timestamp(line)
+        if line_timestamp:
+            if timestamp and not (start and timestamp < start):
+                yield make_log_record(timestamp, record_offset, text_parts)
+            if (end and line_timestamp > end) or (end_offset is not None and offset >= end_offset):
+                return
+            timestamp = line_timestamp
+            record_offset = offset
+            text_parts.clear()
+        if timestamp:
+            text_parts.append(line)
+        offset += len(line)
+    if timestamp and not (start and timestamp < start):
+        yield make_log_record(timestamp, record_offset, text_parts)
+
+
+def iter_records(path, start=None, end=None, start_offset=None, end_offset=None):
+    '''
+        Yields a LogRecord for each log message in the log file with a timestamp between start and end, reading the
+        file in large blocks. The file is positioned at start with seek_to_timestamp instead of being read up to it,
+        or for a compressed file at the frame holding start. Local copies of log files are indexed the first time
+        they are read in full, without start or end, and their index is used to start at the sampled message before
+        start from then on. A read of a time period is never made to read the whole file to index it.
+        Giving start_offset and end_offset limits it to the messages starting in that byte range of the file, which
+        should be one returned by get_record_aligned_ranges.
+    '''
+    if start_offset is None and end_offset is None and is_local_copy(path):
+        index = log_index.load_index(path)
+        if index:
+            start_offset = log_index.find_offset_for_timestamp(index, start) if start else 0
+        elif not start and not end:
+            yield from index_records(path)
+            return
+    if log_store.is_compressed(path):
+        if start_offset is None:
+            start_offset = log_store.find_frame_offset_for_timestamp(path, start) if start else 0
+        log_h = log_store.open_log(path, start_offset)
+        offset = start_offset
+    else:
+        log_h = open(path, "rb", buffering=RECORD_READ_BUFFER_SIZE)
+        if start_offset is not None:
+            log_h.seek(start_offset)
+            offset = start_offset
+        else:
+            offset = seek_to_timestamp(log_h, start) if start else 0
+    with log_h:
+        yield from read_records(log_h, offset, start, end, end_offset)
+
+
+def is_local_copy(path):
+    ''' Returns True for files in LOCAL_LOG_DIRECTORY, which get a sidecar index, unlike logs read in place. '''
+    return pathlib.Path(environment.LOCAL_LOG_DIRECTORY).resolve() in pathlib.Path(path).resolve().parents
+
+
+def index_records(path):
+    ''' Yields every log message of the log file, like iter_records, and builds its index, which is saved next to it. '''
+    builder = log_index.IndexBuilder(path)
+    with log_store.open_log(path) as log_h:
+        for record in read_records(log_h):
+            builder.add(record)
+            yield record
+    builder.save()
+
+
+def extend_index(path, index, offset):
+    '''
+        Adds the log messages appended to the log file from offset to its index from before the append, and saves
+        it, so a sync does not make the next reader index the whole file again.
+    '''
+    builder = log_index.IndexBuilder(path, index)
+    # The message that was at the end of the file before may have got more lines, but it is already counted
+    with log_store.open_log(path, offset) as log_h:
+        for record in read_records(log_h, offset):
+            builder.add(record)
+    builder.save()
+
+
+def get_log_index(path):
+    ''' Returns the index of the log file, building it if needed. It is only saved next to local copies. '''
+    index = log_index.load_index(path)
+    if not index:
+        builder = log_index.IndexBuilder(path)
+        with log_store.open_log(path) as log_h:
+            for record in read_records(log_h):
+                builder.add(record)
+        index = (builder.save() if is_local_copy(path) else None) or builder.get_index()
+    return index
+
+
+def split_range(range_start, range_end, count, snap_to_record):
+    '''
+        Splits range_start to range_end into count ranges of about the same size, moving each boundary with
+        snap_to_record(offset) to the start of a log message. Returns a list of (start_offset, end_offset).
+    '''
+    boundaries = [range_start]
+    for index in range(1, count):
+        boundary = min(snap_to_record(range_start + (range_end - range_start) * index // count), range_end)
+        if boundary > boundaries[-1]:
+            boundaries.append(boundary)
+    if range_end > boundaries[-1]:
+        boundaries.append(range_end)
+    return list(zip(boundaries[:-1], boundaries[1:]))
+
+
+def get_record_aligned_ranges(path, count, start=None, end=None):
+    '''
+        Splits the part of the log file between the start and end timestamps into count byte ranges of about the same
+        size, each starting at the beginning of a log message, so each can be read with iter_records by a separate
+        worker. Compressed files are split on frames. Returns a list of (start_offset, end_offset), in file order.
+    '''
+    if log_store.is_compressed(path):
+        frames = log_store.get_frame_offsets(path)
+        if not frames:
+            return []
+        range_start = log_store.find_frame_offset_for_timestamp(path, start) if start else frames[0][0]
+        range_end = next((frame_offset for (frame_offset, frame_timestamp) in frames if end and frame_timestamp > end), log_store.get_log_size(path))
+        frame_offsets = [frame_offset for (frame_offset, frame_timestamp) in frames]
+        return split_range(range_start, range_end, count,
+                           lambda offset: next((frame_offset for frame_offset in frame_offsets if frame_offset >= offset), range_end))
+
+    with open(path, "rb") as log_h:
+        if os.fstat(log_h.fileno()).st_size == 0:
+            return []
+        with mmap.mmap(log_h.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            if start:
+                range_start = find_offset_for_timestamp(mm, start)
+            else:
+                range_start = get_timestamped_line_at_or_after(mm, 0)[0]
+            if end:
+                range_end = find_offset_for_timestamp(mm, end + datetime.timedelta(microseconds=1))
+            else:
+                range_end = len(mm)
+            return split_range(range_start, range_end, count, lambda offset: get_timestamped_line_at_or_after(mm, offset)[0])
+
+
+def get_server_name(file_path):
+    ''' Returns the server name part, including its trailing underscore, of a local log file name, or "" '''
+    parts = FILENAME_PATTERN.match(file_path.name)
+    if parts:
+        return parts.groupdict()['server_name'] or ""
+    logging.debug("Cannot parse server name from filename {}. Using no server name for generated extract file name".format(file_path.name))
+    return ""
+
+
+def tag_records(server, records):
+    for record in records:
+        yield server, record
+
+
+def merge_records(found_files, start_timestamp=None, end_timestamp=None):
+    '''
+        Yields (server, record) for the log messages of all the files in timestamp order, with a heap based k-way
+        merge that only holds the next log message of each file in memory. Messages with the same timestamp keep the
+        order of found_files.
+    '''
+    streams = [tag_records(get_server_name(file_path).rstrip("_"), iter_records(file_path, start_timestamp, end_timestamp))
+               for file_path in found_files]
+    return heapq.merge(*streams, key=lambda server_record: server_record[1].timestamp)
+
+
+def extract_to_merged_file(found_files, env_name, app_name, start_timestamp, end_timestamp):
+    '''
+        Extracts the log messages in the time period from the files of all the servers into one file in timestamp
+        order, with the server name added after the timestamp of each message.
+    '''
+    extracted_log_dir = pathlib.Path(environment.LOCAL_LOG_DIRECTORY, env_name, app_name, "extracted")
+    extracted_log_dir.mkdir(parents=True, exist_ok=True)
+    extracted_file_path = pathlib.Path(extracted_log_dir, "{}-merged-{}-{}.log".format(app_name, start_timestamp.strftime('%Y-%m-%d_%H-%M-%S'), end_timestamp.strftime('%Y-%m-%d_%H-%M-%S')))
+    with open(extracted_file_path, "w") as extracted_h:
+        for (server, record) in merge_records(found_files, start_timestamp, end_timestamp):
+            timestamp_length = log_timestamps.get_timestamp_length(record.text)
+            extracted_h.write("{0} [{1}]{2}".format(record.text[:timestamp_length], server, record.text[timestamp_length:]))
+    log_catalog.add_log_file(env_name, app_name, None, start_timestamp, end_timestamp, extracted_file_path, log_catalog.KIND_EXTRACTED)
+    return [extracted_file_path]
 
 
 def extract_to_new_files(found_files, env_name, app_name, start_timestamp, end_timestamp):
     extracted_log_dir = pathlib.Path(environment.LOCAL_LOG_DIRECTORY, env_name, app_name, "extracted")
-    if not extracted_log_dir.exists():
-        extracted_log_dir.mkdir()
+    extracted_log_dir.mkdir(parents=True, exist_ok=True)
     extracted_files = {}
     for file_path in found_files:    
-        parts = FILENAME_PATTERN.match(file_path.name)
-        if parts:
-            server = parts.groupdict()['server_name']
-        else:
-            server = ""
-            logging.debug("Cannot parse server name from filename {}. Using no server name for generated extract file name".format())
+        server = get_server_name(file_path)
         if server not in extracted_files:
             extracted_file_path = pathlib.Path(extracted_log_dir, "{}-{}-{}-{}.log".format(app_name, server, start_timestamp.strftime('%Y-%m-%d_%H-%M-%S'), end_timestamp.strftime('%Y-%m-%d_%H-%M-%S')))
             if extracted_file_path.exists():
                 extracted_file_path.unlink()
             extracted_files[server] = {"handle": open(extracted_file_path, "w"), "path": extracted_file_path}
-        with open(file_path, "r") as file_h:
-            current_line = None
-            log_timestamp, rest_of_line, current_line = get_log_msg(file_h, current_line)
-            while rest_of_line and current_line and log_timestamp and log_timestamp <= end_timestamp:
-                if start_timestamp <= log_timestamp and log_timestamp <= end_timestamp:
-                    for line in rest_of_line:
-                        extracted_files[server]["handle"].write(line)
-
-                log_timestamp, rest_of_line, current_line = get_log_msg(file_h, current_line)
-                # logging.info("\rpath: {} read {:2.0f}% timestamp: {}  rest_of_line empty: {}".format(path, (log_h.tell()/file_size*100), start_timestamp, not rest_of_line))
-        
-    for extracted_file in extracted_files.values():
+        for record in iter_records(file_path, start_timestamp, end_timestamp):
+            extracted_files[server]["handle"].write(record.text)
+
+    for (server, extracted_file) in extracted_files.items():
         if extracted_file["handle"] and not extracted_file["handle"].closed:
             extracted_file["handle"].close()
+        log_catalog.add_log_file(env_name, app_name, server.rstrip("_"), start_timestamp, end_timestamp, extracted_file["path"], log_catalog.KIND_EXTRACTED)
 
     return [extracted_file["path"] for extracted_file in extracted_files.values()]
 
 
-def get_logs(env_name, app_name, timestamp=None, end_timestamp=None, force_get=None, extract_to_new_file=None):
+def summarize_logs(found_files, start_timestamp=None, end_timestamp=None):
+    '''
+        Returns {server: Counter of the log messages by level} for the minutes from start_timestamp to end_timestamp,
+        from the indexes of the files instead of their log messages.
+    '''
+    summary = {}
+    for file_path in found_files:
+        server = get_server_name(file_path).rstrip("_")
+        summary.setdefault(server, collections.Counter()).update(log_index.count_levels(get_log_index(file_path), start_timestamp, end_timestamp))
+    return summary
+
+
+def get_logs(env_name, app_name, timestamp=None, end_timestamp=None, force_get=None, extract_to_new_file=None, workers=None, incremental=None, merge_servers=None):
     if env_name not in environment.LOG_LOCATIONS.keys():
         raise Exception()
     if app_name not in environment.LOG_APP_PATHS.keys():
         raise Exception()
     if not timestamp:
         timestamp = datetime.Datetime.now() - 1
-    if not force_get:
+    if env_name == "localhost":
+        # There are no local copies of localhost logs, they are read in place
+        log_paths = []
+    elif not force_get:
         log_paths = get_logs_from_local(env_name, app_name, timestamp, end_timestamp)
     else:
         logging.info("Forced to get latest files from remote!")
         log_paths = []
     if not log_paths:
-        log_paths = copy_logs_from_remote_to_local(env_name, app_name, timestamp, end_timestamp)
-    if extract_to_new_file:
+        log_paths = copy_logs_from_remote_to_local(env_name, app_name, timestamp, end_timestamp, workers, incremental)
+    if extract_to_new_file and merge_servers:
+        return extract_to_merged_file(log_paths, env_name, app_name, timestamp, end_timestamp)
+    elif extract_to_new_file:
         return extract_to_new_files(log_paths, env_name, app_name, timestamp, end_timestamp)
     else:
         return log_paths
@@ -244,17 +1047,40 @@ if __name__ == "__main__":
     parser.add_argument('-t', '--timestamp', dest='timestamp', type=valid_datetime_type, default=(datetime.datetime.now()-datetime.timedelta(days=1)), help='Starting Timestamp to get logs for in format "YYYY-MM-DD HH:mm". Use qutes around the timestamp if including hours and minutes. Defaults to one day before now.')    
     parser.add_argument('-n', '--end', dest='end_timestamp', type=valid_datetime_type, default=(datetime.datetime.now()), help='End Timestamp to get logs for in format "YYYY-MM-DD HH:mm". Use quotes around the timestamp if including hours and minutes. Defaults to now.')    
     parser.add_argument("-o", "--open", dest="open_output", action="store_true", help="Flag to indicate to open the log file(s) in an editor once the script has completed.")
+    parser.add_argument("-w", "--workers", dest="workers", type=int, default=DEFAULT_DOWNLOAD_WORKERS, help="Number of log files to download from the remote servers at the same time. Defaults to {0}.".format(DEFAULT_DOWNLOAD_WORKERS))
+    parser.add_argument("-i", "--incremental", dest="incremental", action="store_true", help="Only get the part of the current remote log files that was added since they were last downloaded.")
+    parser.add_argument("-c", "--catalog", dest="rebuild_catalog", action="store_true", help="Rebuild the catalog of local log files for the application in the environment from the files in the local log directory.")
+    parser.add_argument("-m", "--merge", dest="merge_servers", action="store_true", help="Extract the logs of all the servers into one file in timestamp order, instead of one file per server. Implies -x/--extract.")
+    parser.add_argument("-s", "--summary", dest="summary", action="store_true", help="Show the number of log messages by level and server for the time period, from the indexes of the log files.")
+    parser.add_argument("-z", "--compress", dest="compress", action="store_true", help="Compress the existing plain local copies of the log files for the application in the environment.")
     args = parser.parse_args()
     log_level = logging.DEBUG if args.verbose else logging.INFO
     
     log_file_path = common_utils.get_log_file_path("/home/fergusos/reports", "logs")
     common_utils.setup_logger_to_console_file(log_file_path, log_level)
     
+    if args.compress:
+        count = compress_local_logs(args.env_name, args.app_name)
+        logging.info("\nCompressed {0} local log files for the {1} app in the {2} environment.".format(count, args.app_name, args.env_name))
+    if args.rebuild_catalog:
+        count = catalog_local_logs(args.env_name, args.app_name, rebuild=True)
+        logging.info("\nAdded {0} local log files for the {1} app in the {2} environment to the catalog.".format(count, args.app_name, args.env_name))
+
     log_paths = []
     end_timestamp = args.end_timestamp 
-    if args.extract:
+    args.extract = args.extract or args.merge_servers
+    if args.summary:
+        log_paths = get_logs(args.env_name, args.app_name, args.timestamp, end_timestamp, args.force_get, None, args.workers, args.incremental)
+        summary = summarize_logs(log_paths, args.timestamp, end_timestamp)
+        levels = sorted({level for counts in summary.values() for level in counts})
+        logging.info("\nLog messages by level for the {0} app in the {1} environment from {2:%Y-%m-%d %H:%M} to {3:%Y-%m-%d %H:%M}:\n".format(args.app_name, args.env_name, args.timestamp, end_timestamp))
+        logging.info("{0:20}".format("server") + "".join("{0:>10}".format(level) for level in levels))
+        for (server, counts) in summary.items():
+            logging.info("{0:20}".format(server or "-") + "".join("{0:>10}".format(counts[level]) for level in levels))
+        log_paths = []
+    elif args.extract:
         logging.info("\nExtracting logs for the {0} app in the {1} environment for the time period between {2:%Y%m%d-%H%M%s} and {3:%Y%m%d-%H%M%s}.\n".format(args.app_name, args.env_name, args.timestamp, end_timestamp))
-        log_paths = get_logs(args.env_name, args.app_name, args.timestamp, end_timestamp, args.force_get, args.extract)
+        log_paths = get_logs(args.env_name, args.app_name, args.timestamp, end_timestamp, args.force_get, args.extract, args.workers, args.incremental, args.merge_servers)
         if log_paths:
             logging.info("\nThe logs for the {0} app in the {1} environment can be found here:".format(args.app_name, args.env_name))
             for pth in log_paths:
@@ -263,7 +1089,7 @@ if __name__ == "__main__":
             logging.info("\nCould not find logs for the {0} app in the {1} environment for the time period of {2} to {3}.".format(args.app_name, args.env_name, args.timestamp, args.end_timestamp))
     else:
         logging.info("\nSearching for logs for the {0} app in the {1} environment for the time period between {2:%Y%m%d-%H%M%s} and {3:%Y%m%d-%H%M%s}.\n".format(args.app_name, args.env_name, args.timestamp, end_timestamp))
-        log_paths = get_logs(args.env_name, args.app_name, args.timestamp, end_timestamp, args.force_get, args.extract)
+        log_paths = get_logs(args.env_name, args.app_name, args.timestamp, end_timestamp, args.force_get, args.extract, args.workers, args.incremental, args.merge_servers)
         if log_paths:
             logging.info("\nThe logs for the {0} app in the {1} environment can be found here:".format(args.app_name, args.env_name))
             for pth in log_paths:
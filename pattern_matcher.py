@@ -0,0 +1,140 @@
+import re
+
+'''
+    Matching of many patterns against a log message in a single scan. Every pattern is compiled into one regular
+    expression alternation, with a named group per pattern, so a message is scanned once no matter how many patterns
+    are being watched for. The substring patterns are compiled into a single alternative shaped like a trie of their
+    characters, as the regular expression engine would otherwise try every substring at every position: with
+    hundreds of them, that is as slow as the trie is fast. The trie has no groups, which would have to be saved at
+    every branch, so the pattern it found is looked up from the text it matched.
+
+    A pattern is either a string, which is matched as a plain substring, or a dict with one of these forms:
+        {"substring": "ORA-00060", "name": "deadlock"}
+        {"regex": "ORA-\\d{5}", "name": "oracle errors"}
+    The name is optional and defaults to the substring or regex itself. Several patterns can have the same substring
+    under different names, and are all found by find_all. Regex patterns cannot use numbered backreferences, as the
+    group numbers change once the patterns are combined, nor global flags other than at their start: inline flags
+    like "(?i)timeout" only apply to their own pattern.
+'''
+
+LEADING_FLAGS_PATTERN = re.compile(r"^\(\?([aiLmsux]+)\)")
+
+
+def get_pattern_substring(pattern):
+    ''' Returns the substring of a substring pattern from the configuration, or None for a regex pattern. '''
+    if isinstance(pattern, dict):
+        return pattern.get("substring")
+    return pattern
+
+
+def get_trie_expression(substrings):
+    ''' Returns the regular expression of the trie of the substrings. '''
+    trie = {}
+    for substring in substrings:
+        node = trie
+        for char in substring:
+            node = node.setdefault(char, {})
+        # The key of the end of a substring cannot be a character
+        node[""] = True
+    return get_trie_node_expression(trie)
+
+
+def get_trie_node_expression(node):
+    literal = ""
+    while len(node) == 1 and "" not in node:
+        ((char, node),) = node.items()
+        literal += re.escape(char)
+    # The longer substrings first, and the end of a substring last
+    alternatives = [re.escape(char) + get_trie_node_expression(child) for (char, child) in node.items() if char]
+    if "" in node:
+        alternatives.append("")
+    if len(alternatives) == 1:
+        return literal + alternatives[0]
+    return "{0}(?:{1})".format(literal, "|".join(alternatives))
+
+
+def get_scoped_expression(expression):
+    ''' Returns the regular expression with its leading global flags, like (?i), turned into a group scoped to it. '''
+    flags = LEADING_FLAGS_PATTERN.match(expression)
+    if not flags:
+        return expression
+    # A verbose regex can end in a comment, which would swallow the closing parenthesis
+    end = "\n)" if "x" in flags.group(1) else ")"
+    return "(?{0}:{1}{2}".format(flags.group(1), expression[flags.end():], end)
+
+
+def get_pattern_expression(pattern):
+    ''' Returns (name, regular expression) for a pattern from the configuration. '''
+    if isinstance(pattern, dict):
+        if "regex" in pattern:
+            return pattern.get("name", pattern["regex"]), pattern["regex"]
+        return pattern.get("name", pattern["substring"]), re.escape(pattern["substring"])
+    return pattern, re.escape(pattern)
+
+
+class PatternMatcher:
+
+    def __init__(self, patterns):
+        self.names = []
+        self.regexes = {}
+        self.group_names = {}
+        alternatives = []
+        # The groups of all the patterns of a substring, in the order they were given
+        self.substring_groups = {}
+        for (index, pattern) in enumerate(patterns):
+            name, expression = get_pattern_expression(pattern)
+            group = "pattern{0}".format(index)
+            if name not in self.regexes:
+                self.names.append(name)
+                try:
+                    self.regexes[name] = re.compile(expression)
+                except re.error as ex:
+                    raise ValueError("Invalid regular expression {0!r} of the pattern {1!r}: {2}".format(expression, name, ex))
+            self.group_names[group] = name
+            substring = get_pattern_substring(pattern)
+            if substring is not None:
+                self.substring_groups.setdefault(substring, []).append(group)
+            else:
+                alternatives.append("(?P<{0}>{1})".format(group, get_scoped_expression(expression)))
+        if self.substring_groups:
+            alternatives.insert(0, get_trie_expression(self.substring_groups))
+        self.combined = re.compile("|".join(alternatives)) if alternatives else None
+
+    def search(self, text):
+        ''' Returns True if any of the patterns is in the text. '''
+        return self.combined is not None and self.combined.search(text) is not None
+
+    def find_first(self, text):
+        '''
+            Returns the name of the pattern found first in the text, the longest substring of the ones found there, or
+            None. Of the patterns of the same substring, it is the one given first.
+        '''
+        match = self.combined.search(text) if self.combined is not None else None
+        return self.get_name(match) if match else None
+
+    def get_name(self, match):
+        return self.get_names(match)[0]
+
+    def get_names(self, match):
+        if match.lastgroup:
+            return [self.group_names[match.lastgroup]]
+        return [self.group_names[group] for group in self.substring_groups[match.group()]]
+
+    def find_all(self, text):
+        ''' Returns the names of all the patterns found in the text, in the order the patterns were given. '''
+        if self.combined is None:
+            return []
+        found = set()
+        spans = []
+        for match in self.combined.finditer(text):
+            found.update(self.get_names(match))
+            spans.append(match.span())
+        if spans and len(found) < len(self.names):
+            # The scan does not report a pattern whose matches all overlap the match of an earlier pattern, and such a
+            # match can only start inside one of the reported matches, so only those positions need to be tried.
+            for name in self.names:
+                if name not in found:
+                    regex = self.regexes[name]
+                    if any(regex.match(text, position) for (start, end) in spans for position in range(start, end)):
+                        found.add(name)
+        return [name for name in self.names if name in found]
@@ -0,0 +1,39 @@
+import datetime
+import unittest
+
+import log_templates
+
+
+class GetTokensTest(unittest.TestCase):
+
+    def test_masks_numbers(self):
+        self.assertEqual(log_templates.get_tokens("Could not get application 1234 for user 56 in 0.25 s"),
+                         ["Could", "not", "get", "application", "<*>", "for", "user", "<*>", "in", "<*>", "s"])
+
+    def test_keeps_error_codes(self):
+        self.assertEqual(log_templates.get_tokens("Query 12 failed: ORA-00060: deadlock detected"),
+                         ["Query", "<*>", "failed:", "ORA-00060:", "deadlock", "detected"])
+
+    def test_error_codes_give_different_tokens(self):
+        self.assertNotEqual(log_templates.get_tokens("Query failed: ORA-00060: deadlock detected"),
+                            log_templates.get_tokens("Query failed: ORA-01555: deadlock detected"))
+
+    def test_masks_upper_case_prefixed_ids(self):
+        self.assertEqual(log_templates.get_tokens("Sent JMS-123456 for ID-123e4567-e89b-12d3-a456-426614174000"),
+                         ["Sent", "JMS-<*>", "for", "ID-<*>"])
+
+
+class TemplateMinerTest(unittest.TestCase):
+
+    def test_error_codes_give_different_templates(self):
+        miner = log_templates.TemplateMiner()
+        timestamp = datetime.datetime(2020, 3, 26, 14, 7)
+        first = miner.add("ORA-00060: Query 12 failed", timestamp)
+        second = miner.add("ORA-01555: Query 34 failed", timestamp)
+        self.assertNotEqual(first.template_id, second.template_id)
+        self.assertEqual(first.text(), "ORA-00060: Query <*> failed")
+        self.assertEqual(second.text(), "ORA-01555: Query <*> failed")
+
+
+if __name__ == "__main__":
+    unittest.main()